@@ -0,0 +1,279 @@
+'''
+
+Benchmarks for the core request paths
+
+This script seeds a throwaway database with a configurable number of
+posts, then drives the app through app.test_client() and measures the
+latency of each request. For every scenario it reports the throughput in
+requests per second and the p50, p90 and p99 latencies in milliseconds.
+
+    python benchmarks/run.py --posts 10000 --requests 500 -o before.json
+
+The results also list the calls and time of every named statement from
+flaskr.queries that ran during each scenario.
+
+The results are written as JSON, so two runs can be compared:
+
+    python benchmarks/run.py --posts 10000 -o after.json --compare before.json
+
+Config values can be overridden with --set, for example to measure the
+requests with a file page cache or with a connection pool:
+
+    python benchmarks/run.py --set PAGE_CACHE_TYPE=file --set DB_POOL_SIZE=4
+
+The database, the compiled templates and the file caches are kept in a
+temporary folder that is removed afterwards, so a run never writes to
+the instance folder and always starts with cold caches.
+
+With --compare, every scenario whose p50 got slower by more than
+--tolerance (10% by default) is listed and the script exits with status 1,
+which makes it usable as a regression check between commits.
+
+The scenarios are:
+
+    index           GET /, with the page cache cleared before every
+                    request so the page is queried and rendered
+    index-cached    GET /, answered from the page cache after the first
+                    request
+    login   POST /auth/login
+    create  POST /create
+    update  POST /<id>/update
+    delete  POST /<id>/delete
+
+Going through the test client skips the network and the WSGI server but
+runs everything flaskr itself does: routing, sessions, SQL, hashing and
+template rendering.
+
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from flaskr.db import get_db, init_db  # noqa: E402
+from flaskr.queries import get_stats  # noqa: E402
+
+SCENARIOS = ('index', 'index-cached', 'login', 'create', 'update', 'delete')
+
+
+def seed(app, posts, hash_method):
+    """Create the benchmark user and ``posts`` posts owned by it."""
+    with app.app_context():
+        init_db()
+        db = get_db()
+        db.execute(
+            'INSERT INTO user (username, password) VALUES (?, ?)',
+            ('bench', generate_password_hash('bench', hash_method)),
+        )
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            " VALUES (?, ?, 1, datetime('2018-01-01', ? || ' seconds'))",
+            ((f'post {n}', f'body of post {n}\n' * 5, n)
+             for n in range(posts)),
+        )
+        db.commit()
+
+
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def measure(requests, call, prepare=None):
+    """Call ``call(n)`` ``requests`` times and summarize the latencies.
+    ``prepare(n)``, if given, runs before each call and isn't timed.
+    """
+    timings = []
+    elapsed = 0
+
+    for n in range(requests):
+        if prepare is not None:
+            prepare(n)
+
+        t = time.perf_counter()
+        response = call(n)
+        # a streamed body is only rendered as it is read, and closing
+        # the response tears down its request context
+        response.get_data()
+        response.close()
+        timings.append(time.perf_counter() - t)
+        elapsed += timings[-1]
+
+        if response.status_code >= 400:
+            raise RuntimeError(f'request failed with {response.status}')
+
+    return {
+        'requests': requests,
+        'throughput': requests / elapsed,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p90_ms': percentile(timings, 90) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+    }
+
+
+def run(posts, requests, scenarios, hash_method, config=None):
+    tmp = tempfile.mkdtemp()
+
+    try:
+        app = create_app({
+            'DATABASE': os.path.join(tmp, 'bench.sqlite'),
+            'PASSWORD_HASH_METHOD': hash_method,
+            'PAGE_CACHE_DIR': os.path.join(tmp, 'page_cache'),
+            'TEMPLATE_CACHE_DIR': os.path.join(tmp, 'jinja_cache'),
+            **(config or {}),
+        })
+        # init_db() and the file caches default to the instance folder
+        app.instance_path = tmp
+        seed(app, posts, hash_method)
+        client = app.test_client()
+        login = {'username': 'bench', 'password': 'bench'}
+        client.post('/auth/login', data=login)
+        results = {}
+
+        def clear_page_cache(n):
+            cache = app.extensions.get('flaskr.page_cache')
+
+            if cache is not None:
+                cache.clear()
+
+        calls = {
+            'index': lambda n: client.get('/'),
+            'index-cached': lambda n: client.get('/'),
+            'login': lambda n: client.post('/auth/login', data=login),
+            'create': lambda n: client.post(
+                '/create', data={'title': f'new {n}', 'body': 'body'}),
+            'update': lambda n: client.post(
+                '/1/update', data={'title': f'edit {n}', 'body': ''}),
+            # delete the seeded posts newest first, so the post that
+            # update edits is never deleted
+            'delete': lambda n: client.post(f'/{posts - n}/delete'),
+        }
+
+        for name in scenarios:
+            count = requests
+
+            if name == 'delete':
+                count = min(requests, posts - 1)
+
+            if count <= 0:
+                print(f'skipping {name}: nothing to measure', file=sys.stderr)
+                continue
+
+            stats = get_stats(app)
+            stats.reset()
+            prepare = clear_page_cache if name == 'index' else None
+            results[name] = measure(count, calls[name], prepare)
+            results[name]['queries'] = stats.snapshot()
+
+        return results
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """List scenarios whose p50 regressed by more than ``tolerance``."""
+    regressions = []
+
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+
+        if before is None:
+            continue
+
+        change = result['p50_ms'] / before['p50_ms'] - 1
+
+        if change > tolerance:
+            regressions.append(
+                f'{name}: p50 {before["p50_ms"]:.2f}ms -> '
+                f'{result["p50_ms"]:.2f}ms (+{change:.0%})'
+            )
+
+    return regressions
+
+
+def parse_setting(text):
+    name, _, value = text.partition('=')
+
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+
+    return name, value
+
+
+def at_least(minimum):
+    def parse(text):
+        value = int(text)
+
+        if value < minimum:
+            raise argparse.ArgumentTypeError(f'must be at least {minimum}')
+
+        return value
+
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    # update edits post 1 and delete removes the others, so it needs two
+    parser.add_argument('--posts', type=at_least(2), default=1000,
+                        help='number of posts to seed, at least 2')
+    parser.add_argument('--requests', type=at_least(1), default=200,
+                        help='requests per scenario')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='scenario to run, may be repeated (default: all)')
+    parser.add_argument('--hash-method', default='pbkdf2:sha256:260000',
+                        help='password hash method for the benchmark user')
+    parser.add_argument('--set', action='append', type=parse_setting,
+                        default=[], metavar='KEY=VALUE',
+                        help='override a config value, parsed as JSON')
+    parser.add_argument('-o', '--output', help='write the JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed p50 slowdown when comparing')
+    args = parser.parse_args(argv)
+
+    config = dict(args.set)
+    results = run(args.posts, args.requests, args.scenario or SCENARIOS,
+                  args.hash_method, config)
+    report = {
+        'posts': args.posts,
+        'config': config,
+        'python': platform.python_version(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for line in regressions:
+            print('regression:', line, file=sys.stderr)
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
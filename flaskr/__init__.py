@@ -19,19 +19,92 @@ In another application you might give the blog blueprint a url_prefix and define
 separate index view in the application factory, similar to the hello view. Then the 
 index and blog.index endpoints and URLs would be different.
 
+Every worker of a pre-fork server runs create_app() before it can take 
+requests, so it is kept cheap. The blueprints still have to be 
+registered here, since Flask builds its URL map at registration and 
+doesn't allow adding to it once requests are handled, but the modules 
+only import what every request needs. Heavier dependencies, such as 
+the process pool for hashing, the writer thread, gzip and csv, are 
+imported the first time they are used, and the database's folder is 
+created by init-db and db upgrade instead of on every start.
+
+create_app() records how long each phase of the startup took in 
+app.extensions['flaskr.startup'], as (phase, seconds) pairs. With the 
+PROFILE_STARTUP config or the FLASKR_PROFILE_STARTUP environment 
+variable set, the phases are also written to the log, which shows 
+where a slow start is spent.
+
 '''
 
-import os,random
+import os
+import time
 
 from flask import Flask
 
 
 def create_app(test_config=None):
+    start = last = time.perf_counter()
+    phases = []
+
+    def phase(name):
+        nonlocal last
+        now = time.perf_counter()
+        phases.append((name, now - last))
+        last = now
+
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        DB_POOL_SIZE=0,
+        DB_PRAGMA_PROFILE='default',
+        DB_PRAGMAS={},
+        DB_READ_PRAGMAS={'cache_size': -32000},
+        SQL_INSTRUMENT=False,
+        SQL_SLOW_QUERY_MS=100,
+        SQL_N_PLUS_ONE_THRESHOLD=5,
+        USER_CACHE_TYPE='lru',
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=60,
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:260000',
+        PASSWORD_HASH_WORKERS=0,
+        PASSWORD_HASH_MAX_PENDING=64,
+        PASSWORD_HASH_TIMEOUT=10,
+        POSTS_PER_PAGE=20,
+        STREAM_INDEX=False,
+        CHANGES_PAGE_SIZE=500,
+        EXPORT_CHUNK_SIZE=1000,
+        PAGE_CACHE_TYPE='lru',
+        PAGE_CACHE_SIZE=256,
+        PAGE_CACHE_DIR=None,
+        POST_CACHE_TYPE='lru',
+        POST_CACHE_SIZE=1024,
+        WRITE_QUEUE=False,
+        WRITE_QUEUE_WINDOW_MS=2,
+        WRITE_QUEUE_MAX_BATCH=100,
+        WRITE_QUEUE_TIMEOUT=30,
+        METRICS=False,
+        METRICS_BUCKETS=None,
+        ASSETS_DIR=None,
+        ASSETS_FINGERPRINT=None,
+        ASSETS_MAX_AGE=365 * 24 * 60 * 60,
+        TEMPLATE_BYTECODE_CACHE=None,
+        TEMPLATE_CACHE_DIR=None,
+        TEMPLATE_WARMUP=None,
+        BUILD_ID=None,
+        SERVER_TIMING=False,
+        PROFILE=False,
+        PROFILE_MODE='sample',
+        PROFILE_SAMPLE_RATE=0.01,
+        PROFILE_ENDPOINTS=(),
+        PROFILE_HEADER=None,
+        PROFILE_SECRET=None,
+        PROFILE_INTERVAL_MS=5,
+        PROFILE_DIR=None,
+        PROFILE_MAX_FILES=100,
+        PROFILE_MAX_BYTES=50 * 1024 * 1024,
+        PROFILE_STARTUP=bool(os.environ.get('FLASKR_PROFILE_STARTUP')),
     )
 
     if test_config is None:
@@ -41,11 +114,7 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
-    # ensure the instance folder exists
-    try:
-        os.makedirs(app.instance_path)
-    except OSError:
-        pass
+    phase('config')
 
     # a simple page that says hello
     @app.route('/hello')
@@ -55,12 +124,48 @@ def create_app(test_config=None):
 
     from . import db
     db.init_app(app)
+    phase('db')
+
+    from . import transfer
+    transfer.init_app(app)
+    phase('transfer')
     
     from . import auth
     app.register_blueprint(auth.bp)
+    phase('auth')
     
     from . import blog
     app.register_blueprint(blog.bp)
     app.add_url_rule('/', endpoint='index')
+    phase('blog')
+
+    from . import metrics
+    metrics.init_app(app)
+    phase('metrics')
+
+    from . import profiler
+    profiler.init_app(app)
+    phase('profiler')
+
+    from . import timing
+    timing.init_app(app)
+    phase('timing')
+
+    from . import assets
+    assets.init_app(app)
+    phase('assets')
+
+    # last, the warm-up needs every blueprint's templates
+    from . import templating
+    templating.init_app(app)
+    phase('templates')
+
+    phases.append(('total', time.perf_counter() - start))
+    app.extensions['flaskr.startup'] = phases
+
+    if app.config['PROFILE_STARTUP']:
+        app.logger.info('Startup: %s', ', '.join(
+            f'{name} {seconds * 1000:.1f}ms' for name, seconds in phases
+        ))
     
     return app
\ No newline at end of file
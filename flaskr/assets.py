@@ -0,0 +1,246 @@
+'''
+Fingerprinted, precompressed static files
+
+Files served from /static/<name> can change with any deploy, so
+browsers have to check with the server before using a cached copy.
+flask build-assets makes copies whose names can never be reused for
+different content, so they can be cached for good:
+
+    flask build-assets
+
+For every file in the static folder it
+
+    1.  minifies it if it is a stylesheet, removing comments and
+        whitespace (other files are copied as they are),
+    2.  names the copy after a hash of its content, style.css becoming
+        for example style.3f9a1c0b2d4e.css, in ASSETS_DIR, the assets
+        folder in the instance folder by default,
+    3.  writes a .gz next to text files, and a .br if the optional
+        brotli package is installed, when that makes them smaller,
+    4.  and records the names in ASSETS_DIR/manifest.json.
+
+Once the manifest exists, url_for('static', filename='style.css')
+returns /static/dist/style.3f9a1c0b2d4e.css instead. That URL is served
+by the assets view, which sends the .br or .gz variant when the client
+accepts it, with Cache-Control: immutable and a max-age of
+ASSETS_MAX_AGE seconds. Files that aren't in the manifest keep their
+plain /static URL.
+
+The manifest is read once per process, so run build-assets before the
+workers start. ASSETS_FINGERPRINT turns the rewriting off; it is off
+by default in debug mode, where a stale manifest would hide edits to
+the static files. Relative url() references in stylesheets are not
+rewritten, since the copies are served from /static/dist/.
+
+'''
+
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app
+from flask import request
+from flask import send_file
+from flask.cli import with_appcontext
+from werkzeug.exceptions import abort
+from werkzeug.security import safe_join
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.map')
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# string literals are kept as they are, comments are dropped
+_css_token = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S
+)
+_css_space = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(text):
+    """Remove comments and unneeded whitespace from a stylesheet."""
+    parts = []
+    code = ''
+    last = 0
+
+    for match in _css_token.finditer(text):
+        code += text[last:match.start()]
+        last = match.end()
+
+        if match.group(1) is None:
+            # a comment separates what is around it like a space
+            code += ' '
+        else:
+            parts.append(_minify_css_code(code))
+            parts.append(match.group(1))
+            code = ''
+
+    parts.append(_minify_css_code(code + text[last:]))
+    return ''.join(parts).strip()
+
+
+def _minify_css_code(code):
+    code = _css_space.sub(r'\1', re.sub(r'\s+', ' ', code))
+    return code.replace(';}', '}')
+
+
+def get_assets_dir(app):
+    return app.config['ASSETS_DIR'] or os.path.join(app.instance_path, 'assets')
+
+
+def get_manifest(app):
+    """Get the mapping of static file names to their fingerprinted
+    names, empty if build-assets hasn't been run."""
+    manifest = app.extensions.get('flaskr.assets')
+
+    if manifest is None:
+        try:
+            with open(os.path.join(get_assets_dir(app), 'manifest.json')) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+
+        manifest = app.extensions.setdefault('flaskr.assets', manifest)
+
+    return manifest
+
+
+def fingerprint_name(name, data):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+
+    with open(tmp, 'wb') as f:
+        f.write(data)
+
+    os.replace(tmp, path)
+
+
+def build_assets(app, echo=None):
+    """Fingerprint, minify and compress all static files of an app.
+    :return: the manifest
+    """
+    # imported here, only the build needs them
+    import gzip
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    directory = get_assets_dir(app)
+    manifest = {}
+
+    for root, dirs, files in os.walk(app.static_folder):
+        dirs.sort()
+
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            if name.endswith('.css'):
+                data = minify_css(data.decode('utf8')).encode('utf8')
+
+            hashed = fingerprint_name(name, data)
+            target = os.path.join(directory, hashed)
+            _write(target, data)
+            sizes = [str(len(data))]
+
+            if name.endswith(COMPRESSIBLE):
+                variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+
+                if brotli is not None:
+                    variants.append(('.br', brotli.compress(data)))
+
+                for suffix, compressed in variants:
+                    if len(compressed) < len(data):
+                        _write(target + suffix, compressed)
+                        sizes.append(f'{suffix[1:]} {len(compressed)}')
+
+            manifest[name] = hashed
+
+            if echo is not None:
+                echo(f'{name} -> {hashed} ({", ".join(sizes)} bytes)')
+
+    _write(
+        os.path.join(directory, 'manifest.json'),
+        json.dumps(manifest, indent=2, sort_keys=True).encode('utf8'),
+    )
+    app.extensions['flaskr.assets'] = manifest
+    return manifest
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint, minify and precompress the static files."""
+    manifest = build_assets(current_app._get_current_object(), click.echo)
+    click.echo(f'Built {len(manifest)} assets.')
+
+
+def fingerprint(endpoint, values):
+    if endpoint != 'static':
+        return
+
+    app = current_app._get_current_object()
+    enabled = app.config['ASSETS_FINGERPRINT']
+
+    if enabled is None:
+        enabled = not app.debug
+
+    if not enabled:
+        return
+
+    hashed = get_manifest(app).get(values.get('filename'))
+
+    if hashed is not None:
+        values['filename'] = f'dist/{hashed}'
+
+
+def serve_asset(filename):
+    """Send a built asset, precompressed if the client accepts it."""
+    app = current_app._get_current_object()
+    path = safe_join(get_assets_dir(app), filename)
+
+    if path is None or filename == 'manifest.json' or not os.path.isfile(path):
+        abort(404)
+
+    encoding = None
+
+    for name, suffix in ENCODINGS:
+        # a quality of 0 means the client refuses the encoding
+        accepted = request.accept_encodings[name] > 0
+
+        if accepted and os.path.isfile(path + suffix):
+            encoding = name
+            path += suffix
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_file(path, mimetype=mimetype)
+    max_age = app.config['ASSETS_MAX_AGE']
+    # the name changes whenever the content does
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    response.vary.add('Accept-Encoding')
+
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
+def init_app(app):
+    app.cli.add_command(build_assets_command)
+    app.url_defaults(fingerprint)
+    app.add_url_rule(
+        f'{app.static_url_path}/dist/<path:filename>', 'assets', serve_asset
+    )
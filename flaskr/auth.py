@@ -21,19 +21,26 @@ URLs associated with the blueprint.
 '''
 
 import functools
+import os
+import sqlite3
 
 from flask import Blueprint
+from flask import current_app
 from flask import flash
 from flask import g
+from flask import has_request_context
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import session
 from flask import url_for
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
+from flask.ctx import _AppCtxGlobals
 
-from flaskr.db import get_db
+from flaskr.cache import make_cache
+from flaskr.db import get_read_db
+from flaskr.hashing import get_hasher
+from flaskr.queries import run
+from flaskr.writer import execute
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -51,18 +58,77 @@ def login_required(view):
     return wrapped_view
 
 
-@bp.before_app_request
+def get_user_cache():
+    """Get the cache of user rows for the current app, or ``None`` if
+    ``USER_CACHE_TYPE`` disables it."""
+    app = current_app._get_current_object()
+
+    if "flaskr.user_cache" not in app.extensions:
+        app.extensions["flaskr.user_cache"] = make_cache(
+            app.config["USER_CACHE_TYPE"],
+            max_size=app.config["USER_CACHE_SIZE"],
+            directory=os.path.join(app.instance_path, "user_cache"),
+            ttl=app.config["USER_CACHE_TTL"],
+        )
+
+    return app.extensions["flaskr.user_cache"]
+
+
+def invalidate_user(user_id):
+    """Drop a cached user. Call this whenever a user row is inserted,
+    changed or deleted so the next request sees the new data."""
+    cache = get_user_cache()
+
+    if cache is not None:
+        cache.delete(user_id)
+
+
 def load_logged_in_user():
     """If a user id is stored in the session, load the user object from
-    the database into ``g.user``."""
+    the cache or the database. Only the ``id`` and ``username`` are
+    loaded, the password hash never goes into the cache.
+    :return: the user row, or ``None`` if nobody is logged in
+    """
+    if not has_request_context():
+        return None
+
     user_id = session.get("user_id")
 
     if user_id is None:
-        g.user = None
-    else:
-        g.user = (
-            get_db().execute("SELECT * FROM user WHERE id = ?", (user_id,)).fetchone()
-        )
+        return None
+
+    cache = get_user_cache()
+    user = cache.get(user_id) if cache is not None else None
+
+    if user is None:
+        user = run(get_read_db(), "user.session", (user_id,)).fetchone()
+
+        if user is not None:
+            # a plain dict can be pickled by the file cache
+            user = dict(user)
+
+            if cache is not None:
+                cache.set(user_id, user)
+
+    return user
+
+
+class LazyUserGlobals(_AppCtxGlobals):
+    """The ``g`` object, but ``g.user`` is only loaded the first time
+    it is accessed, so requests that never look at the user don't touch
+    the database."""
+
+    def __getattr__(self, name):
+        if name == "user":
+            self.user = load_logged_in_user()
+            return self.user
+
+        raise AttributeError(name)
+
+
+@bp.record_once
+def use_lazy_user(state):
+    state.app.app_ctx_globals_class = LazyUserGlobals
 
 
 @bp.route("/register", methods=("GET", "POST"))
@@ -74,28 +140,30 @@ def register():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        db = get_db()
+        db = get_read_db()
         error = None
 
         if not username:
             error = "Username is required."
         elif not password:
             error = "Password is required."
-        elif (
-            db.execute("SELECT id FROM user WHERE username = ?", (username,)).fetchone()
-            is not None
-        ):
+        elif run(db, "user.id_by_username", (username,)).fetchone() is not None:
             error = f"User {username} is already registered."
 
         if error is None:
             # the name is available, store it in the database and go to
-            # the login page
-            db.execute(
-                "INSERT INTO user (username, password) VALUES (?, ?)",
-                (username, generate_password_hash(password)),
-            )
-            db.commit()
-            return redirect(url_for("auth.login"))
+            # the login page. Hash first, so the write isn't held up
+            # while hashing.
+            pwhash = get_hasher(current_app).generate(password)
+
+            try:
+                user_id = execute("user.insert", (username, pwhash))
+            except sqlite3.IntegrityError:
+                # another request registered the name since the check
+                error = f"User {username} is already registered."
+            else:
+                invalidate_user(user_id)
+                return redirect(url_for("auth.login"))
 
         flash(error)
 
@@ -108,18 +176,24 @@ def login():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        db = get_db()
         error = None
-        user = db.execute(
-            "SELECT * FROM user WHERE username = ?", (username,)
-        ).fetchone()
+        user = run(get_read_db(), "user.by_username", (username,)).fetchone()
+
+        hasher = get_hasher(current_app)
 
         if user is None:
             error = "Incorrect username."
-        elif not check_password_hash(user["password"], password):
+        elif not hasher.check(user["password"], password):
             error = "Incorrect password."
 
         if error is None:
+            if hasher.needs_rehash(user["password"]):
+                # the password is known to be correct here, so upgrade
+                # the stored hash to the current method and cost
+                pwhash = hasher.generate(password)
+                execute("user.set_password", (pwhash, user["id"]))
+                invalidate_user(user["id"])
+
             # store the user id in a new session and return to the index
             session.clear()
             session["user_id"] = user["id"]
@@ -167,10 +241,12 @@ Here’s what the register view function is doing:
 
     6.  If validation succeeds, insert the new user data into the 
     database. For security, passwords should never be stored in the 
-    database directly. Instead, generate_password_hash() is used to 
-    securely hash the password, and that hash is stored. Since this 
-    query modifies data, db.commit() needs to be called afterwards 
-    to save the changes.
+    database directly. Instead, the app's PasswordHasher calls 
+    generate_password_hash() to securely hash the password, possibly 
+    in a separate process, and that hash is stored. Since this 
+    query modifies data, it goes through flaskr.writer.execute(), 
+    which commits the change, or hands it to the writer thread that 
+    commits it together with other writes.
 
     7.  After storing the user, they are redirected to the login page. 
     url_for() generates the URL for the login view based on its 
@@ -193,7 +269,9 @@ There are a few differences from the register view:
 
     2.  check_password_hash() hashes the submitted password in 
     the same way as the stored hash and securely compares them. 
-    If they match, the password is valid.
+    If they match, the password is valid. If the stored hash was 
+    made with an older PASSWORD_HASH_METHOD, it is replaced with a 
+    new hash while the plain password is at hand.
 
     3.  session is a dict that stores data across requests. When 
     validation succeeds, the user’s id is stored in a new session. 
@@ -201,12 +279,18 @@ There are a few differences from the register view:
     the browser then sends it back with subsequent requests. Flask 
     securely signs the data so that it can’t be tampered with.
 
-bp.before_app_request() registers a function that runs before the 
-view function, no matter what URL is requested. load_logged_in_user 
-checks if a user id is stored in the session and gets that user’s 
-data from the database, storing it on g.user, which lasts for the 
-length of the request. If there is no user id, or if the id doesn’t 
-exist, g.user will be None.
+load_logged_in_user checks if a user id is stored in the session and 
+gets that user’s data from the database. It is not run before every 
+request. Instead the blueprint swaps the app’s g class for 
+LazyUserGlobals, which calls load_logged_in_user the first time g.user 
+is read and stores the result on g for the rest of the request. Static 
+files and /hello never read g.user, so they never query the database. 
+If there is no user id, or if the id doesn’t exist, g.user will be None.
+
+Loaded users are kept in a small cache with a USER_CACHE_TTL, so a 
+logged in user browsing the blog isn't looked up again on every page. 
+Anything that changes a user row must call invalidate_user() with the 
+user’s id.
 
 To log out, you need to remove the user id from the session. Then load_
 logged_in_user won’t load a user on subsequent requests.
@@ -47,31 +47,428 @@ the POST method and then redirect to the index view.
 '''
 
 
+import functools
+import hashlib
+import math
+import os
+import re
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+from datetime import timezone
+
 from flask import Blueprint
+from flask import current_app
 from flask import flash
 from flask import g
+from flask import get_flashed_messages
+from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import Response
+from flask import session
+from flask import stream_with_context
 from flask import url_for
+from markupsafe import escape
+from markupsafe import Markup
 from werkzeug.exceptions import abort
 
 from flaskr.auth import login_required
-from flaskr.db import get_db
+from flaskr.cache import make_cache
+from flaskr.db import fits_integer
+from flaskr.db import get_read_db
+from flaskr.queries import run
+from flaskr.templating import get_build_id
+from flaskr.templating import get_build_time
+from flaskr.writer import execute
 
 bp = Blueprint("blog", __name__)
 
 
+def _pack_cursor(*values):
+    key = "|".join(str(value) for value in values)
+    return urlsafe_b64encode(key.encode("utf8")).decode("ascii").rstrip("=")
+
+
+def _unpack_cursor(cursor, count):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = urlsafe_b64decode(padded).decode("utf8").rsplit("|", count - 1)
+    except ValueError:
+        values = ()
+
+    if len(values) != count:
+        abort(400, "Invalid page cursor.")
+
+    return values
+
+
+def encode_cursor(post):
+    """Encode the keyset position of a post as an opaque URL token.
+    :param post: a row with ``created`` and ``id`` columns
+    :return: a url safe string that can be passed back to the index
+    """
+    return _pack_cursor(post["created"], post["id"])
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by :func:`encode_cursor`.
+    :param cursor: the token from the url
+    :return: a ``(created, id)`` tuple to compare against
+    :raise 400: if the cursor is malformed
+    """
+    created, id = _unpack_cursor(cursor, 2)
+
+    try:
+        id = int(id)
+    except ValueError:
+        id = None
+
+    if id is None or not fits_integer(id):
+        abort(400, "Invalid page cursor.")
+
+    return created, id
+
+
+class LazyPage(object):
+    """A page of posts read from the cursor while it is iterated.
+    ``next`` and ``prev`` are only known once iteration has reached the
+    end and the start of the page, which is when a streamed template
+    renders the links that use them.
+    """
+
+    def __init__(self, rows, per_page, has_prev):
+        self._rows = rows
+        self._per_page = per_page
+        self._has_prev = has_prev
+        self.next = None
+        self.prev = None
+
+    @property
+    def posts(self):
+        last = None
+
+        for n, row in enumerate(self._rows):
+            if n == self._per_page:
+                self.next = encode_cursor(last)
+                break
+
+            if n == 0 and self._has_prev:
+                self.prev = encode_cursor(row)
+
+            last = row
+            yield row
+
+
+def get_page(after=None, before=None, per_page=None, lazy=False):
+    """Get one page of posts, most recent first, using keyset pagination.
+    Rows are located by seeking the ``(created, id)`` index to the
+    cursor position, so the cost does not depend on how deep the page
+    is. One extra row is fetched to know whether another page exists.
+    :param after: cursor of the last post on the previous page
+    :param before: cursor of the first post on the next page
+    :param per_page: number of posts per page, defaults to the
+        ``POSTS_PER_PAGE`` config
+    :param lazy: return a :class:`LazyPage` that reads rows from the
+        cursor as it is iterated instead of fetching them up front.
+        Pages going backwards with ``before`` are always fetched, since
+        their rows have to be reversed.
+    :return: a dict with the ``posts`` and the ``next``/``prev`` cursors
+    """
+    if per_page is None:
+        per_page = current_app.config["POSTS_PER_PAGE"]
+
+    db = get_read_db()
+
+    if before is not None:
+        # walk the index forwards from the cursor, then flip the rows
+        # back into display order
+        posts = run(
+            db, "post.page_before", (*decode_cursor(before), per_page + 1)
+        ).fetchall()
+        has_prev = len(posts) > per_page
+        posts = posts[:per_page][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            cursor = run(
+                db, "post.page_after", (*decode_cursor(after), per_page + 1)
+            )
+        else:
+            cursor = run(db, "post.page", (per_page + 1,))
+
+        if lazy:
+            return LazyPage(cursor, per_page, has_prev=after is not None)
+
+        posts = cursor.fetchall()
+        has_next = len(posts) > per_page
+        posts = posts[:per_page]
+        has_prev = after is not None
+
+    return {
+        "posts": posts,
+        "next": encode_cursor(posts[-1]) if posts and has_next else None,
+        "prev": encode_cursor(posts[0]) if posts and has_prev else None,
+    }
+
+
+def stream_template(template_name, **context):
+    """Render a template piece by piece as the response is sent.
+    Like ``render_template``, but returns an iterator of strings, so
+    the first bytes can be sent before the whole page is rendered.
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    # send a few statements' output per chunk instead of every fragment
+    stream.enable_buffering(5)
+    return stream
+
+
+def get_post_version():
+    """Get the ``post_version`` row, read once per request.
+    Triggers bump it on every write to ``post``, by any process, so it
+    tells whether anything derived from the posts is still current.
+    """
+    if "post_version" not in g:
+        g.post_version = run(get_read_db(), "post.version").fetchone()
+
+    return g.post_version
+
+
+def is_wal():
+    """Whether the database is in WAL mode.
+    A SELECT that is still open holds SQLite's shared lock, which
+    blocks writers in the rollback journal modes until it finishes, so
+    rows are only read while a page is streamed under WAL.
+    """
+    mode = run(get_read_db(), "db.journal_mode").fetchone()[0]
+    return mode.lower() == "wal"
+
+
+def get_validators():
+    """Get the ``ETag`` and ``Last-Modified`` values for the current
+    request without rendering anything.
+    The build, the post version, the viewer and the URL identify the
+    page that would be rendered. A time can't tell viewers apart, so
+    logged in viewers, whose pages show their own edit links, only get
+    the ``ETag``. For the others it is the later of the last write and
+    the last change to the templates or assets.
+    :return: an ``(etag, last_modified)`` tuple, ``last_modified`` is
+        ``None`` for logged in viewers
+    """
+    version = get_post_version()
+    user_id = session.get("user_id")
+    key = f"{get_build_id()}:{version['version']}:{user_id}:{request.full_path}"
+    etag = hashlib.sha1(key.encode("utf8")).hexdigest()
+
+    if user_id is not None:
+        return etag, None
+
+    modified = version["modified"].replace(tzinfo=timezone.utc)
+    return etag, max(modified, get_build_time())
+
+
+def conditional(view):
+    """View decorator that answers conditional GET requests.
+    The validators are checked before the view runs, so a client that
+    already has the current page gets a 304 without any listing query
+    or rendering. Otherwise the response is sent with the validators
+    so the client can ask again next time.
+    """
+
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        # flashed messages are part of the page but not of the validators
+        if request.method not in ("GET", "HEAD") or "_flashes" in session:
+            return view(**kwargs)
+
+        etag, last_modified = get_validators()
+
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since and last_modified is not None:
+            fresh = last_modified <= request.if_modified_since
+        else:
+            fresh = False
+
+        if fresh:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(**kwargs))
+
+        response.set_etag(etag, weak=True)
+
+        if last_modified is not None:
+            response.last_modified = last_modified
+
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
+
+    return wrapped_view
+
+
+def get_page_cache():
+    """Get the cache of rendered index pages for the current app, or
+    ``None`` if ``PAGE_CACHE_TYPE`` disables it."""
+    app = current_app._get_current_object()
+
+    if "flaskr.page_cache" not in app.extensions:
+        app.extensions["flaskr.page_cache"] = make_cache(
+            app.config["PAGE_CACHE_TYPE"],
+            max_size=app.config["PAGE_CACHE_SIZE"],
+            directory=app.config["PAGE_CACHE_DIR"]
+            or os.path.join(app.instance_path, "page_cache"),
+        )
+
+    return app.extensions["flaskr.page_cache"]
+
+
+def invalidate_index():
+    """Drop all cached index pages. Called after any write to posts.
+    Pages from before a write are never served again since the post
+    version is part of their key, this only frees the space early.
+    """
+    cache = get_page_cache()
+
+    if cache is not None:
+        cache.clear()
+
+
 @bp.route("/")
+@conditional
 def index():
-    """Show all the posts, most recent first."""
-    db = get_db()
-    posts = db.execute(
-        "SELECT p.id, title, body, created, author_id, username"
-        " FROM post p JOIN user u ON p.author_id = u.id"
-        " ORDER BY created DESC"
-    ).fetchall()
-    return render_template("blog/index.html", posts=posts)
+    """Show a page of posts, most recent first.
+    Rendered pages are cached per viewer, since the page shows edit
+    links only for the viewer's own posts, and per post version, so a
+    write by any worker makes the cached pages of all workers stale.
+    The build id is part of the key too, so pages in a file cache that
+    outlived a deploy are not served by the new templates' workers.
+    Pages with pending flashed
+    messages are rendered fresh and not cached. With ``STREAM_INDEX``
+    enabled, pages that aren't cached are streamed instead of being
+    cached. Under WAL the rows are read as the page is sent, otherwise
+    they are fetched first so the client doesn't hold up writers.
+    """
+    cache = get_page_cache()
+    key = None
+    after = request.args.get("after")
+    before = request.args.get("before")
+
+    if cache is not None and "_flashes" not in session:
+        key = (
+            get_build_id(),
+            get_post_version()["version"],
+            session.get("user_id"),
+            after,
+            before,
+        )
+        html = cache.get(key)
+
+        if html is not None:
+            return html
+
+    if current_app.config["STREAM_INDEX"]:
+        # pop pending messages now, so that the session cookie, which
+        # is sent before the body, records that they were shown
+        get_flashed_messages()
+        page = get_page(after=after, before=before, lazy=is_wal())
+        return Response(
+            stream_with_context(stream_template("blog/index.html", page=page))
+        )
+
+    page = get_page(after=after, before=before)
+    html = render_template("blog/index.html", page=page)
+
+    if key is not None:
+        cache.set(key, html)
+
+    return html
+
+
+_control_chars = re.compile(r"[\x00-\x1f\x7f]")
+
+
+def _match_expression(q):
+    """Turn user input into an FTS5 query that matches all the words.
+    Each word is quoted so that FTS5 operators and punctuation in the
+    input are searched for literally instead of raising syntax errors.
+    Control characters, which FTS5 can't take even quoted, separate
+    words like spaces.
+    """
+    words = _control_chars.sub(" ", q).split()
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def _highlight(snippet):
+    """Escape a snippet and turn the match markers into ``<mark>``."""
+    return (
+        escape(snippet)
+        .replace("\x02", Markup("<mark>"))
+        .replace("\x03", Markup("</mark>"))
+    )
+
+
+def search_posts(q, after=None, per_page=None):
+    """Search post titles and bodies, best match first.
+    Uses the ``post_fts`` full text index, so only matching posts are
+    read. Results are ordered by ``(rank, id)`` and paged with a keyset
+    cursor on those columns.
+    :param q: the words to search for
+    :param after: cursor of the last result on the previous page
+    :param per_page: number of results per page, defaults to the
+        ``POSTS_PER_PAGE`` config
+    :return: a dict with the ``posts`` and the ``next`` cursor
+    """
+    if per_page is None:
+        per_page = current_app.config["POSTS_PER_PAGE"]
+
+    expression = _match_expression(q)
+
+    if not expression:
+        return {"posts": [], "next": None}
+
+    name = "post.search"
+    params = [expression]
+
+    if after is not None:
+        rank, id = _unpack_cursor(after, 2)
+
+        try:
+            rank, id = float(rank), int(id)
+        except ValueError:
+            rank = id = None
+
+        if rank is None or not math.isfinite(rank) or not fits_integer(id):
+            abort(400, "Invalid page cursor.")
+
+        params += [rank, id]
+
+        name = "post.search_after"
+
+    rows = run(get_read_db(), name, (*params, per_page + 1)).fetchall()
+    posts = [
+        dict(row, snippet=_highlight(row["snippet"])) for row in rows[:per_page]
+    ]
+    last = rows[per_page - 1] if len(rows) > per_page else None
+
+    return {
+        "posts": posts,
+        "next": _pack_cursor(repr(last["rank"]), last["id"]) if last else None,
+    }
+
+
+@bp.route("/search")
+def search():
+    """Search posts by the words in the ``q`` argument."""
+    q = request.args.get("q", "").strip()
+    page = {"posts": [], "next": None}
+
+    if q:
+        page = search_posts(q, after=request.args.get("after"))
+
+    return render_template("blog/search.html", q=q, **page)
 
 
 def get_post(id, check_author=True):
@@ -84,16 +481,11 @@ def get_post(id, check_author=True):
     :raise 404: if a post with the given id doesn't exist
     :raise 403: if the current user isn't the author
     """
-    post = (
-        get_db()
-        .execute(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            " WHERE p.id = ?",
-            (id,),
-        )
-        .fetchone()
-    )
+    # no post has an id sqlite3 can't bind
+    if fits_integer(id):
+        post = run(get_read_db(), "post.by_id", (id,)).fetchone()
+    else:
+        post = None
 
     if post is None:
         abort(404, f"Post id {id} doesn't exist.")
@@ -104,6 +496,80 @@ def get_post(id, check_author=True):
     return post
 
 
+def get_post_cache():
+    """Get the cache of hot posts for the current app, or ``None`` if
+    ``POST_CACHE_TYPE`` disables it."""
+    app = current_app._get_current_object()
+
+    if "flaskr.post_cache" not in app.extensions:
+        app.extensions["flaskr.post_cache"] = make_cache(
+            app.config["POST_CACHE_TYPE"],
+            max_size=app.config["POST_CACHE_SIZE"],
+            directory=os.path.join(app.instance_path, "post_cache"),
+        )
+
+    return app.extensions["flaskr.post_cache"]
+
+
+def invalidate_post(id):
+    """Drop a post from the hot post cache after it changed."""
+    cache = get_post_cache()
+
+    if cache is not None:
+        cache.delete(id)
+
+
+def get_change_seq(id):
+    """Get the ``seq`` of the latest change to a post, which triggers
+    move forward on every write to it."""
+    if not fits_integer(id):
+        return None
+
+    row = run(get_read_db(), "post.change_seq", (id,)).fetchone()
+    return row["seq"] if row is not None else None
+
+
+def get_hot_post(id):
+    """Get a post and its author by id, from the hot post cache if it
+    has been read recently.
+    Entries are stored with the post version and the post's own change
+    ``seq`` they were read at. While the version is the same nothing has
+    been written, and the entry is used without a query. After a write
+    to any post, the entry is still used if the post's ``seq`` hasn't
+    moved, so edits to other posts don't evict it, while an update made
+    by another worker is never hidden by this worker's cache.
+    :param id: id of post to get
+    :return: the post with author information
+    :raise 404: if a post with the given id doesn't exist
+    """
+    cache = get_post_cache()
+    version = get_post_version()["version"]
+    entry = cache.get(id) if cache is not None else None
+
+    if entry is not None and entry[0] == version:
+        return entry[2]
+
+    seq = get_change_seq(id)
+
+    if entry is not None and entry[1] == seq:
+        post = entry[2]
+    else:
+        # a plain dict can be pickled by the file cache
+        post = dict(get_post(id, check_author=False))
+
+    if cache is not None:
+        cache.set(id, (version, seq, post))
+
+    return post
+
+
+@bp.route("/<int:id>")
+@conditional
+def detail(id):
+    """Show a single post to anyone."""
+    return render_template("blog/detail.html", post=get_hot_post(id))
+
+
 @bp.route("/create", methods=("GET", "POST"))
 @login_required
 def create():
@@ -119,12 +585,8 @@ def create():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                "INSERT INTO post (title, body, author_id) VALUES (?, ?, ?)",
-                (title, body, g.user["id"]),
-            )
-            db.commit()
+            execute("post.insert", (title, body, g.user["id"]))
+            invalidate_index()
             return redirect(url_for("blog.index"))
 
     return render_template("blog/create.html")
@@ -147,11 +609,9 @@ def update(id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                "UPDATE post SET title = ?, body = ? WHERE id = ?", (title, body, id)
-            )
-            db.commit()
+            execute("post.update", (title, body, id))
+            invalidate_index()
+            invalidate_post(id)
             return redirect(url_for("blog.index"))
 
     return render_template("blog/update.html", post=post)
@@ -165,7 +625,7 @@ def delete(id):
     author of the post.
     """
     get_post(id)
-    db = get_db()
-    db.execute("DELETE FROM post WHERE id = ?", (id,))
-    db.commit()
+    execute("post.delete", (id,))
+    invalidate_index()
+    invalidate_post(id)
     return redirect(url_for("blog.index"))
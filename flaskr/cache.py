@@ -0,0 +1,208 @@
+'''
+Small caches for rendered pages and other hot data
+
+Both caches have the same interface: get(key) returns the stored value
+or None, set(key, value) stores one, delete(key) drops a single entry
+and clear() drops everything. They count hits and misses so the hit
+ratio can be checked in production.
+
+LRUCache keeps values in memory in an OrderedDict. Every get moves the
+entry to the end, and when the cache grows past max_size the entry at
+the front, the one used least recently, is evicted. It is guarded by a
+lock so it can be shared by all threads of a worker.
+
+FileCache stores each value as a pickle file in a directory, named by
+a hash of the key. It survives worker restarts and is shared between
+the processes of a pre-fork server, at the cost of a file read per hit.
+When a set takes it past max_size files, the oldest ones are deleted.
+Each cache object counts the files it adds instead of listing the
+directory on every set, and only lists it to prune once that count goes
+past max_size, so the limit is approximate when several processes write
+to the same directory.
+
+Both take an optional ttl in seconds after which an entry is treated as
+missing even if nothing invalidated it.
+
+make_cache() builds one of them from a type name so the backend can be
+picked in the config.
+
+'''
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    def __init__(self, max_size=128, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileCache(object):
+    def __init__(self, directory, max_size=1024, ttl=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # files in the directory, as far as this object knows; counted
+        # by the first set
+        self._count = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(repr(key).encode('utf8')).hexdigest()
+        return os.path.join(self.directory, name + '.cache')
+
+    def get(self, key):
+        path = self._path(key)
+
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.time() + self.ttl
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        # write to a temporary file and rename it into place so readers
+        # in other processes never see a half written entry
+        with open(tmp, 'wb') as f:
+            pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+
+        new = not os.path.exists(path)
+        os.replace(tmp, path)
+
+        if self._count is None:
+            self._count = len(self)
+        elif new:
+            self._count += 1
+
+        if self._count > self.max_size:
+            self._prune()
+
+    def _prune(self):
+        entries = []
+
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.cache'):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass
+
+        self._count = min(len(entries), self.max_size)
+
+        if len(entries) <= self.max_size:
+            return
+
+        entries.sort()
+
+        for _, path in entries[:len(entries) - self.max_size]:
+            try:
+                os.remove(path)
+            except OSError:
+                # another process pruned it first
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            return
+
+        if self._count:
+            self._count -= 1
+
+    def clear(self):
+        self._count = 0
+
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory)
+                   if name.endswith('.cache'))
+
+
+def make_cache(type, max_size=128, directory=None, ttl=None):
+    """Create a cache from its config name.
+    :param type: ``'lru'``, ``'file'``, or ``None`` to disable caching
+    :param max_size: number of entries kept
+    :param directory: where the file cache stores its entries
+    :param ttl: seconds an entry stays valid, or ``None`` for no limit
+    :return: the cache, or ``None`` if caching is disabled
+    """
+    if type is None:
+        return None
+
+    if type == 'lru':
+        return LRUCache(max_size, ttl=ttl)
+
+    if type == 'file':
+        return FileCache(directory, max_size, ttl=ttl)
+
+    raise ValueError(f'Unknown cache type {type!r}.')
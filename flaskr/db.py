@@ -25,6 +25,39 @@ was set. If the connection exists, it is closed. Further down
 you will tell your application about the close_db function in 
 the application factory so that it is called after each request.
 
+When DB_POOL_SIZE is greater than zero, get_db checks a connection out 
+of a ConnectionPool kept in app.extensions instead of opening a new one, 
+and close_db hands it back to the pool instead of closing it. The pool 
+keeps at most DB_POOL_SIZE idle connections; its hit and miss counters 
+are available from get_pool().stats().
+
+connect() applies a PRAGMA profile to every new connection, once, so a 
+pooled connection keeps its settings for its whole life. 
+DB_PRAGMA_PROFILE picks one of PRAGMA_PROFILES ('default', 'read-heavy' 
+or 'write-heavy') and DB_PRAGMAS overrides individual values, so a 
+deployment can put for example
+
+    DB_PRAGMA_PROFILE = 'read-heavy'
+    DB_PRAGMAS = {'mmap_size': 1073741824}
+
+in its instance config.py. Both presets switch the database to WAL mode, 
+which lets blog.index keep reading while blog.create commits.
+
+With SQL_INSTRUMENT or SERVER_TIMING enabled, the connections are 
+InstrumentedConnections from flaskr.querylog, and get_db attaches the 
+request's QueryLog to the connection so every statement is timed and 
+counted. Otherwise they are plain sqlite3 connections.
+
+Views don't use get_db directly. Reads go through get_read_db, which 
+opens the file read-only (mode=ro) with PRAGMA query_only on, plus the 
+DB_READ_PRAGMAS such as a larger cache, so a read path can never write 
+by accident. Writes go through get_write_db, which returns the get_db 
+connection after taking the app's writer lock. The lock is held until 
+teardown, so within one worker write requests take turns instead of 
+failing with "database is locked". Under WAL the readers are never 
+blocked by the writer. Read connections are pooled separately from 
+the writer's.
+
 
 open_resource() opens a file relative to the flaskr package, 
 which is useful since you won’t necessarily know where that 
@@ -43,49 +76,289 @@ up after returning the response.
 app.cli.add_command() adds a new command that can be called with 
 the flask command.
 
+init-db throws away all data. To change the schema of a database that 
+is in use, add a migration and run flask db upgrade instead; flask db 
+status shows which migrations have been applied and flask db downgrade 
+undoes the latest one. See flaskr/migrate.py.
+
 '''
 
+import os
+import re
 import sqlite3
+import threading
+from urllib.parse import quote
 
 import click
 from flask import current_app, g
-from flask.cli import with_appcontext
+from flask.cli import AppGroup, with_appcontext
+
+from flaskr import migrate, queries, querylog
+from flaskr.pool import ConnectionPool
+from flaskr.querylog import InstrumentedConnection, get_query_log
+
+
+# PRAGMAs that may be set from the config, in the order they are applied.
+# busy_timeout goes first so that switching journal_mode waits for other
+# connections instead of failing with "database is locked".
+PRAGMAS = (
+    'busy_timeout',
+    'journal_mode',
+    'synchronous',
+    'cache_size',
+    'mmap_size',
+    'temp_store',
+    'wal_autocheckpoint',
+    'query_only',
+)
+
+PRAGMA_PROFILES = {
+    # SQLite's own defaults
+    'default': {},
+    # many readers, few writers: WAL lets readers run during a commit,
+    # and a large cache and memory map keep hot pages out of the kernel
+    'read-heavy': {
+        'busy_timeout': 5000,
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'memory',
+    },
+    # bursts of writes: WAL with synchronous=normal only syncs at
+    # checkpoints, which happen less often, and writers wait longer for
+    # the lock instead of erroring
+    'write-heavy': {
+        'busy_timeout': 15000,
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': -16000,
+        'mmap_size': 0,
+        'temp_store': 'memory',
+        'wal_autocheckpoint': 4000,
+    },
+}
+
+_pragma_value = re.compile(r'^-?[0-9]+$|^[A-Za-z]+$')
+
+
+def fits_integer(value):
+    """Whether an int fits in SQLite's 64 bit INTEGER. sqlite3 raises
+    OverflowError for anything bigger, so ids and cursors taken from
+    requests are checked with this before they are bound."""
+    return -(2**63) <= value < 2**63
+
+
+def get_pragmas(config):
+    try:
+        pragmas = dict(PRAGMA_PROFILES[config['DB_PRAGMA_PROFILE']])
+    except KeyError:
+        raise ValueError(
+            f"Unknown DB_PRAGMA_PROFILE {config['DB_PRAGMA_PROFILE']!r}."
+        ) from None
+
+    pragmas.update(config['DB_PRAGMAS'])
+
+    return pragmas
+
+
+def apply_pragmas(conn, pragmas):
+    for name in pragmas:
+        if name not in PRAGMAS:
+            raise ValueError(f'Unsupported PRAGMA {name!r}.')
+
+    for name in PRAGMAS:
+        if name not in pragmas:
+            continue
+
+        value = str(pragmas[name])
+
+        # PRAGMA values can't be bound as parameters, so only allow
+        # plain integers and keywords through
+        if not _pragma_value.match(value):
+            raise ValueError(f'Invalid value {value!r} for PRAGMA {name}.')
+
+        conn.execute(f'PRAGMA {name} = {value}')
+
+
+def connect(config, read_only=False, **kwargs):
+    if querylog.is_enabled(config):
+        kwargs.setdefault('factory', InstrumentedConnection)
+
+    kwargs.setdefault('cached_statements', queries.statement_cache_size())
+    database = config['DATABASE']
+    pragmas = get_pragmas(config)
+
+    if read_only:
+        database = f'file:{quote(database)}?mode=ro'
+        kwargs['uri'] = True
+        # the journal mode is a property of the database file that only
+        # a writer can change
+        pragmas.pop('journal_mode', None)
+        pragmas.update(config['DB_READ_PRAGMAS'])
+        pragmas['query_only'] = 1
+
+    conn = sqlite3.connect(
+        database,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        **kwargs
+    )
+    conn.row_factory = sqlite3.Row
+
+    try:
+        apply_pragmas(conn, pragmas)
+    except Exception:
+        conn.close()
+        raise
+
+    return conn
+
+
+def get_pool(app=None, read_only=False):
+    if app is None:
+        app = current_app._get_current_object()
+
+    if app.config['DB_POOL_SIZE'] <= 0:
+        return None
+
+    name = 'flaskr.db_read_pool' if read_only else 'flaskr.db_pool'
+    pool = app.extensions.get(name)
+
+    if pool is None:
+        pool = app.extensions.setdefault(name, ConnectionPool(
+            lambda: connect(app.config, read_only, check_same_thread=False),
+            max_size=app.config['DB_POOL_SIZE'],
+        ))
+
+    return pool
+
+
+def _open(read_only=False):
+    pool = get_pool(read_only=read_only)
+
+    if pool is None:
+        db = connect(current_app.config, read_only)
+    else:
+        db = pool.acquire()
+
+    if isinstance(db, InstrumentedConnection):
+        db.log = get_query_log()
+
+    return db
+
+
+def _close(db, read_only=False):
+    if isinstance(db, InstrumentedConnection):
+        db.log = None
+
+    pool = get_pool(read_only=read_only)
+
+    if pool is None:
+        db.close()
+    else:
+        pool.release(db)
 
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = _open()
 
     return g.db
 
 
+def get_read_db():
+    if 'read_db' not in g:
+        g.read_db = _open(read_only=True)
+
+    return g.read_db
+
+
+def get_write_db():
+    if 'write_locked' not in g:
+        lock = current_app.extensions.setdefault(
+            'flaskr.db_write_lock', threading.RLock()
+        )
+        lock.acquire()
+        g.write_locked = True
+
+    return get_db()
+
+
 def close_db(e=None):
     db = g.pop('db', None)
+    read_db = g.pop('read_db', None)
 
     if db is not None:
-        db.close()
+        _close(db)
+
+    if read_db is not None:
+        _close(read_db, read_only=True)
+
+    if g.pop('write_locked', False):
+        current_app.extensions['flaskr.db_write_lock'].release()
   
   
+def make_database_dir():
+    # the database's folder, usually the instance folder, is created
+    # when a database is, not on every create_app()
+    directory = os.path.dirname(current_app.config['DATABASE'])
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
 def init_db():
+    make_database_dir()
     db = get_db()
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    # schema.sql is the latest schema, no migration needs to run on it
+    migrate.stamp(db)
+
 @click.command('init-db')
 @with_appcontext
 def init_db_command():
     """Clear the existing data and create new tables."""
     init_db()
     click.echo('Initialized the database.') 
+
+
+db_cli = AppGroup('db', help='Migrate the database schema.')
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, help='Stop after this version.')
+def upgrade_command(target):
+    """Apply pending migrations."""
+    make_database_dir()
+    applied = migrate.upgrade(get_db(), target, echo=click.echo)
+    click.echo(f'Applied {len(applied)} migrations.')
+
+
+@db_cli.command('downgrade')
+@click.option('--to', 'target', type=int,
+              help='Undo migrations after this version, 0 for all.')
+def downgrade_command(target):
+    """Undo the latest migration, or all migrations after a version."""
+    undone = migrate.downgrade(get_db(), target, echo=click.echo)
+    click.echo(f'Reverted {len(undone)} migrations.')
+
+
+@db_cli.command('status')
+def status_command():
+    """List migrations and whether they are applied."""
+    for migration, applied in migrate.status(get_db()):
+        mark = 'x' if applied else ' '
+        click.echo(f'[{mark}] {migration.version:04d} {migration.name}')
     
     
 def init_app(app):
     app.teardown_appcontext(close_db)
+    querylog.init_app(app)
+    queries.init_app(app)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_cli)
 
     
\ No newline at end of file
@@ -0,0 +1,194 @@
+'''
+Password hashing off the request thread
+
+generate_password_hash() and check_password_hash() are deliberately slow:
+a good password hash costs tens to hundreds of milliseconds of CPU. When
+they run on the request thread, a burst of logins keeps every worker
+busy hashing and ordinary page views have to wait behind them.
+
+PasswordHasher runs the werkzeug functions in a dedicated
+ProcessPoolExecutor with PASSWORD_HASH_WORKERS processes, so hashing
+uses its own CPUs and doesn't hold the GIL of the web worker. The
+processes are started with forkserver, or spawn where that isn't
+available, rather than forked from a web worker whose other threads
+may be holding locks at that moment. At most
+PASSWORD_HASH_MAX_PENDING hashes may be queued or running at once; a
+request that can't get a slot within PASSWORD_HASH_TIMEOUT seconds, or
+whose hash doesn't finish within that time, is answered with 503
+Service Unavailable instead of piling up. If a hash
+process dies, the pool is replaced and the hash is tried once more. With
+PASSWORD_HASH_WORKERS = 0 the hashes run inline, which is what the
+tests and the development server use.
+
+PASSWORD_HASH_METHOD is passed to generate_password_hash() as the
+method, for example 'pbkdf2:sha256:600000'. needs_rehash() compares a
+stored hash against it, with werkzeug's defaults filled in for a pbkdf2
+method that leaves out the hash or the iterations, so login can
+transparently upgrade the stored hash of a user after the cost has
+been raised.
+
+stats() reports the current queue depth and, per operation, how many
+hashes were computed and how long they took.
+
+'''
+
+import threading
+import time
+
+from werkzeug.exceptions import abort
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+
+from flaskr.timing import add_time
+
+
+def hash_prefix(method):
+    """Get the method part that werkzeug writes in front of the hashes
+    made with ``method``, e.g. ``'pbkdf2:sha256:260000'`` for
+    ``'pbkdf2:sha256'``."""
+    if not method.startswith('pbkdf2:'):
+        return method
+
+    args = method[7:].split(':')
+
+    if len(args) == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+
+    return f'pbkdf2:{args[0]}:{int(args[1] or 0)}'
+
+
+class PasswordHasher(object):
+    def __init__(self, method, workers=0, max_pending=64, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._prefix = hash_prefix(method)
+        self.pending = 0
+        self.timings = {
+            'generate': {'count': 0, 'seconds': 0.0, 'max': 0.0},
+            'check': {'count': 0, 'seconds': 0.0, 'max': 0.0},
+        }
+
+    def generate(self, password):
+        """Hash a password with the configured method."""
+        return self._run('generate', generate_password_hash,
+                         password, self.method)
+
+    def check(self, pwhash, password):
+        """Check a password against a stored hash."""
+        return self._run('check', check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check whether a stored hash was made with a different method
+        or cost than the one currently configured."""
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def stats(self):
+        """Return the queue depth and hash timings as a dict."""
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'workers': self.workers,
+                'timings': {k: dict(v) for k, v in self.timings.items()},
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # imported here since multiprocessing is slow to import
+                # and unused when hashing inline
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                else:
+                    context = multiprocessing.get_context('spawn')
+
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=context
+                )
+
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+        executor.shutdown(wait=False)
+
+    def _submit(self, func, *args):
+        # only an alias of the builtin TimeoutError from Python 3.11
+        from concurrent.futures import TimeoutError
+        from concurrent.futures.process import BrokenProcessPool
+
+        for attempt in range(2):
+            executor = self._get_executor()
+
+            try:
+                future = executor.submit(func, *args)
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                # a hash that hasn't started won't run; the request
+                # doesn't wait for one stuck in a worker
+                future.cancel()
+                abort(503, 'Password hashing timed out, try again shortly.')
+            except BrokenProcessPool:
+                # a worker died, for example killed for its memory, and
+                # the pool refuses all work from then on, so start a new
+                # one
+                self._discard(executor)
+
+        abort(503, 'Password hashing is unavailable, try again shortly.')
+
+    def _run(self, op, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            abort(503, 'Too many logins in progress, try again shortly.')
+
+        with self._lock:
+            self.pending += 1
+
+        start = time.perf_counter()
+
+        try:
+            if self.workers > 0:
+                return self._submit(func, *args)
+
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            add_time('hash', elapsed)
+
+            with self._lock:
+                self.pending -= 1
+                timing = self.timings[op]
+                timing['count'] += 1
+                timing['seconds'] += elapsed
+                timing['max'] = max(timing['max'], elapsed)
+
+            self._slots.release()
+
+
+def get_hasher(app):
+    """Get the password hasher configured for an app."""
+    hasher = app.extensions.get('flaskr.hasher')
+
+    if hasher is None:
+        hasher = app.extensions.setdefault('flaskr.hasher', PasswordHasher(
+            app.config['PASSWORD_HASH_METHOD'],
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+            timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+        ))
+
+    return hasher
@@ -0,0 +1,319 @@
+'''
+Metrics for Prometheus
+
+With METRICS enabled, /metrics returns the state of the app in the
+Prometheus text format, ready to be scraped:
+
+    flaskr_request_duration_seconds     histogram of the time to handle a
+                                        request, by endpoint and method,
+                                        with METRICS_BUCKETS as buckets,
+                                        DEFAULT_BUCKETS if it is None
+    flaskr_requests_total               responses by endpoint, method and
+                                        status
+    flaskr_sql_calls_total,             calls, errors and time of every
+    flaskr_sql_errors_total,            named statement from
+    flaskr_sql_seconds_total            flaskr.queries
+    flaskr_db_pool_*                    the counters of the read and write
+                                        connection pools
+    flaskr_write_queue_*                batches and jobs committed by the
+                                        writer thread
+    flaskr_password_hash_seconds        count and time of password hashes
+                                        and checks, and how many are
+                                        pending
+    flaskr_cache_hits_total,            hits and misses of the user, page
+    flaskr_cache_misses_total           and post caches
+
+Only the request metrics are collected as requests are handled: a
+before_request hook notes the start time and an after_request hook adds
+the elapsed time to the histogram, which takes a lock and a few
+additions. Everything else is already counted by the component it
+belongs to, and is read from app.extensions when /metrics is scraped.
+Components that haven't been used yet are left out rather than
+created. For streamed responses the time ends when the response starts,
+not when the last byte has been sent.
+
+The numbers are per process. Under a pre-fork server every worker
+keeps its own, and each scrape sees the worker that happened to answer
+it, so scrape the workers individually or run one worker per target.
+
+'''
+
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, request
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CACHES = (
+    ('user', 'flaskr.user_cache'),
+    ('page', 'flaskr.page_cache'),
+    ('post', 'flaskr.post_cache'),
+)
+
+POOLS = (
+    ('write', 'flaskr.db_pool'),
+    ('read', 'flaskr.db_read_pool'),
+)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        """Count ``value`` in the series with the ``labels`` tuple."""
+        # the first bucket whose upper bound is >= value, or +Inf
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(labels)
+
+            if series is None:
+                series = self._series[labels] = {
+                    'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0,
+                }
+
+            series['counts'][index] += 1
+            series['sum'] += value
+
+    def collect(self):
+        """Yield ``(labels, cumulative_counts, sum)`` for every series."""
+        with self._lock:
+            series = [(labels, list(s['counts']), s['sum'])
+                      for labels, s in self._series.items()]
+
+        for labels, counts, total in series:
+            cumulative = []
+            count = 0
+
+            for n in counts:
+                count += n
+                cumulative.append(count)
+
+            yield labels, cumulative, total
+
+
+class Metrics(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.latency = Histogram(buckets)
+        self._lock = threading.Lock()
+        self.responses = {}
+
+    def observe(self, endpoint, method, status, seconds):
+        self.latency.observe((endpoint, method), seconds)
+
+        with self._lock:
+            key = (endpoint, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def collect_responses(self):
+        """Yield ``((endpoint, method, status), count)`` pairs."""
+        with self._lock:
+            responses = sorted(self.responses.items())
+
+        yield from responses
+
+
+def get_metrics(app=None):
+    """Get the request metrics of an app."""
+    if app is None:
+        app = current_app._get_current_object()
+
+    metrics = app.extensions.get('flaskr.metrics')
+
+    if metrics is None:
+        metrics = app.extensions.setdefault(
+            'flaskr.metrics',
+            Metrics(app.config['METRICS_BUCKETS'] or DEFAULT_BUCKETS),
+        )
+
+    return metrics
+
+
+def start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def record_request(response):
+    start = g.pop('metrics_start', None)
+
+    if start is not None:
+        get_metrics().observe(
+            request.endpoint or 'none', request.method,
+            str(response.status_code), time.perf_counter() - start,
+        )
+
+    return response
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+
+    return '{' + ','.join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    ) + '}'
+
+
+class Exposition(object):
+    """Collects metric families and formats them as text."""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, type, help, samples, labels=()):
+        """Add a family of ``(label_values, value)`` samples."""
+        samples = list(samples)
+
+        if not samples:
+            return
+
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {type}')
+
+        for values, value in samples:
+            self.lines.append(f'{name}{_labels(labels, values)} {value}')
+
+    def histogram(self, name, help, histogram, labels):
+        samples = list(histogram.collect())
+
+        if not samples:
+            return
+
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} histogram')
+        bounds = [repr(float(b)) for b in histogram.buckets] + ['+Inf']
+
+        for values, counts, total in samples:
+            for bound, count in zip(bounds, counts):
+                self.lines.append(
+                    f'{name}_bucket'
+                    f'{_labels(labels + ("le",), values + (bound,))} {count}'
+                )
+
+            self.lines.append(f'{name}_sum{_labels(labels, values)} {total}')
+            self.lines.append(
+                f'{name}_count{_labels(labels, values)} {counts[-1]}'
+            )
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render(app):
+    """Format all metrics of an app in the Prometheus text format."""
+    out = Exposition()
+    extensions = app.extensions
+    metrics = get_metrics(app)
+
+    out.histogram(
+        'flaskr_request_duration_seconds', 'Time to handle a request.',
+        metrics.latency, ('endpoint', 'method'),
+    )
+
+    out.family(
+        'flaskr_requests_total', 'counter', 'Responses sent.',
+        metrics.collect_responses(), ('endpoint', 'method', 'status'),
+    )
+
+    stats = extensions.get('flaskr.query_stats')
+
+    if stats is not None:
+        queries = sorted(stats.snapshot().items())
+
+        for key, type, help in (
+            ('calls', 'counter', 'Executions of a named statement.'),
+            ('errors', 'counter', 'Executions of a named statement that failed.'),
+            ('seconds', 'counter', 'Time spent executing a named statement.'),
+        ):
+            out.family(
+                f'flaskr_sql_{key}_total', type, help,
+                (((name,), s[key]) for name, s in queries), ('query',),
+            )
+
+    pools = [(role, extensions[key].stats())
+             for role, key in POOLS if extensions.get(key) is not None]
+
+    for key, type, help in (
+        ('size', 'gauge', 'Idle connections the pool keeps at most.'),
+        ('idle', 'gauge', 'Idle connections in the pool.'),
+        ('in_use', 'gauge', 'Connections checked out of the pool.'),
+        ('hits', 'counter', 'Connections reused from the pool.'),
+        ('misses', 'counter', 'Connections opened because none was idle.'),
+        ('discarded', 'counter', 'Connections closed by the pool.'),
+    ):
+        suffix = '_total' if type == 'counter' else ''
+        out.family(
+            f'flaskr_db_pool_{key}{suffix}', type, help,
+            (((role,), s[key]) for role, s in pools), ('role',),
+        )
+
+    writes = extensions.get('flaskr.write_queue')
+
+    if writes is not None:
+        out.family('flaskr_write_queue_batches_total', 'counter',
+                   'Transactions committed by the writer thread.',
+                   [((), writes.batches)])
+        out.family('flaskr_write_queue_jobs_total', 'counter',
+                   'Write jobs run by the writer thread.',
+                   [((), writes.jobs)])
+
+    hasher = extensions.get('flaskr.hasher')
+
+    if hasher is not None:
+        hashes = hasher.stats()
+        out.family('flaskr_password_hash_pending', 'gauge',
+                   'Password hashes queued or running.',
+                   [((), hashes['pending'])])
+        timings = sorted(hashes['timings'].items())
+        out.lines += [
+            '# HELP flaskr_password_hash_seconds Time spent hashing passwords.',
+            '# TYPE flaskr_password_hash_seconds summary',
+        ]
+
+        for op, timing in timings:
+            labels = _labels(('op',), (op,))
+            out.lines.append(
+                f'flaskr_password_hash_seconds_sum{labels} {timing["seconds"]}'
+            )
+            out.lines.append(
+                f'flaskr_password_hash_seconds_count{labels} {timing["count"]}'
+            )
+
+    caches = [(name, extensions[key])
+              for name, key in CACHES if extensions.get(key) is not None]
+    out.family('flaskr_cache_hits_total', 'counter', 'Cache lookups that hit.',
+               (((name,), cache.hits) for name, cache in caches), ('cache',))
+    out.family('flaskr_cache_misses_total', 'counter',
+               'Cache lookups that missed.',
+               (((name,), cache.misses) for name, cache in caches), ('cache',))
+
+    return out.text()
+
+
+def metrics_view():
+    return current_app.response_class(
+        render(current_app._get_current_object()),
+        mimetype='text/plain; version=0.0.4',
+        headers={'Cache-Control': 'no-store'},
+    )
+
+
+def init_app(app):
+    if not app.config['METRICS']:
+        return
+
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
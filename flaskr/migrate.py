@@ -0,0 +1,166 @@
+'''
+Versioned schema migrations
+
+init-db runs schema.sql, which drops every table first. That is fine
+for a new install but destroys a database that has real posts in it.
+Migrations change an existing database step by step instead.
+
+Each migration is a module in the flaskr.migrations package named
+<version>_<name>.py, for example 0002_post_created_index.py, with an
+upgrade(db) and a downgrade(db) function. The schema_migrations table
+records which versions have been applied to a database, so upgrade()
+only runs the ones that are missing, in order, and downgrade() undoes
+them in reverse.
+
+Migrations are written so that running one again after it was
+interrupted is safe, using IF NOT EXISTS and checks like
+column_exists(). That matters because a migration doesn't run in a
+single transaction: changes to a large table are made in batches with
+in_batches(), committing after each batch, so other connections can
+keep writing while the migration runs instead of waiting for one huge
+transaction. Adding a column is a metadata-only change in SQLite and
+is instant no matter how many rows the table has; creating an index
+reads the table once, and with WAL enabled readers carry on meanwhile.
+
+schema.sql always describes the latest schema, so init_db() marks
+every migration as applied with stamp() after running it.
+
+The flask db upgrade, flask db downgrade and flask db status commands
+are defined in flaskr.db.
+
+'''
+
+import importlib
+import pkgutil
+import re
+from collections import namedtuple
+
+from flaskr import migrations
+
+Migration = namedtuple('Migration', 'version name module')
+
+_module_name = re.compile(r'^(\d+)_(\w+)$')
+
+
+def load_migrations():
+    """Find all migrations, ordered by version."""
+    found = []
+
+    for info in pkgutil.iter_modules(migrations.__path__):
+        match = _module_name.match(info.name)
+
+        if match is not None:
+            module = importlib.import_module(f'{migrations.__name__}.{info.name}')
+            found.append(Migration(int(match.group(1)), match.group(2), module))
+
+    return sorted(found)
+
+
+def ensure_table(db):
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        ' version INTEGER PRIMARY KEY,'
+        ' name TEXT NOT NULL,'
+        ' applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    )
+    db.commit()
+
+
+def applied_versions(db):
+    ensure_table(db)
+    return {row[0] for row in db.execute('SELECT version FROM schema_migrations')}
+
+
+def upgrade(db, target=None, echo=print):
+    """Apply all migrations up to and including ``target``, or all of
+    them, that haven't been applied yet.
+    :return: the migrations that were applied
+    """
+    done = applied_versions(db)
+    applied = []
+
+    for migration in load_migrations():
+        if target is not None and migration.version > target:
+            break
+
+        if migration.version in done:
+            continue
+
+        echo(f'Applying {migration.version:04d} {migration.name}')
+        migration.module.upgrade(db)
+        db.execute(
+            'INSERT INTO schema_migrations (version, name) VALUES (?, ?)',
+            (migration.version, migration.name),
+        )
+        db.commit()
+        applied.append(migration)
+
+    return applied
+
+
+def downgrade(db, target=None, echo=print):
+    """Undo applied migrations newer than ``target``. Without a target
+    only the latest applied migration is undone.
+    :return: the migrations that were undone
+    """
+    done = applied_versions(db)
+    undone = []
+
+    for migration in reversed(load_migrations()):
+        if migration.version not in done:
+            continue
+
+        if target is not None and migration.version <= target:
+            break
+
+        echo(f'Reverting {migration.version:04d} {migration.name}')
+        migration.module.downgrade(db)
+        db.execute(
+            'DELETE FROM schema_migrations WHERE version = ?',
+            (migration.version,),
+        )
+        db.commit()
+        undone.append(migration)
+
+        if target is None:
+            break
+
+    return undone
+
+
+def stamp(db):
+    """Record every migration as applied without running it."""
+    ensure_table(db)
+    db.executemany(
+        'INSERT OR IGNORE INTO schema_migrations (version, name) VALUES (?, ?)',
+        ((migration.version, migration.name) for migration in load_migrations()),
+    )
+    db.commit()
+
+
+def status(db):
+    """List every migration with whether it has been applied."""
+    done = applied_versions(db)
+    return [(migration, migration.version in done)
+            for migration in load_migrations()]
+
+
+def column_exists(db, table, column):
+    return any(row['name'] == column
+               for row in db.execute(f'PRAGMA table_info({table})'))
+
+
+def in_batches(db, table, sql, batch_size=1000):
+    """Run ``sql`` over ``table`` one range of rowids at a time.
+    The statement gets the first and last rowid of the batch as its two
+    parameters, for example ``UPDATE post SET x = y WHERE id BETWEEN ?
+    AND ?``, and each batch is committed on its own.
+    """
+    low, high = db.execute(f'SELECT MIN(rowid), MAX(rowid) FROM {table}').fetchone()
+
+    if low is None:
+        return
+
+    for start in range(low, high + 1, batch_size):
+        db.execute(sql, (start, start + batch_size - 1))
+        db.commit()
@@ -0,0 +1,29 @@
+'''
+The user and post tables as created by the original tutorial schema.
+'''
+
+
+def upgrade(db):
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS user (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          username TEXT UNIQUE NOT NULL,
+          password TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS post (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          author_id INTEGER NOT NULL,
+          created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          title TEXT NOT NULL,
+          body TEXT NOT NULL,
+          FOREIGN KEY (author_id) REFERENCES user (id)
+        );
+    ''')
+
+
+def downgrade(db):
+    db.executescript('''
+        DROP TABLE IF EXISTS post;
+        DROP TABLE IF EXISTS user;
+    ''')
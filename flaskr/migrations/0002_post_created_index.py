@@ -0,0 +1,11 @@
+'''
+Index for keyset pagination of the blog index on (created, id).
+'''
+
+
+def upgrade(db):
+    db.execute('CREATE INDEX IF NOT EXISTS post_created_id ON post (created, id)')
+
+
+def downgrade(db):
+    db.execute('DROP INDEX IF EXISTS post_created_id')
@@ -0,0 +1,41 @@
+'''
+Full text index over post titles and bodies, kept in sync by triggers.
+Existing posts are indexed with a single rebuild at the end.
+'''
+
+
+def upgrade(db):
+    db.executescript('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+          title,
+          body,
+          content='post',
+          content_rowid='id'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+          INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+          INSERT INTO post_fts (post_fts, rowid, title, body)
+          VALUES ('delete', old.id, old.title, old.body);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, body ON post BEGIN
+          INSERT INTO post_fts (post_fts, rowid, title, body)
+          VALUES ('delete', old.id, old.title, old.body);
+          INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+        END;
+
+        INSERT INTO post_fts (post_fts) VALUES ('rebuild');
+    ''')
+
+
+def downgrade(db):
+    db.executescript('''
+        DROP TRIGGER IF EXISTS post_fts_insert;
+        DROP TRIGGER IF EXISTS post_fts_delete;
+        DROP TRIGGER IF EXISTS post_fts_update;
+        DROP TABLE IF EXISTS post_fts;
+    ''')
@@ -0,0 +1,37 @@
+'''
+Version counter bumped by every write to post, used for conditional GET.
+'''
+
+
+def upgrade(db):
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS post_version (
+          id INTEGER PRIMARY KEY CHECK (id = 1),
+          version INTEGER NOT NULL,
+          modified TIMESTAMP NOT NULL
+        );
+
+        INSERT OR IGNORE INTO post_version (id, version, modified)
+        VALUES (1, 0, CURRENT_TIMESTAMP);
+
+        CREATE TRIGGER IF NOT EXISTS post_version_insert AFTER INSERT ON post BEGIN
+          UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS post_version_update AFTER UPDATE ON post BEGIN
+          UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS post_version_delete AFTER DELETE ON post BEGIN
+          UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+        END;
+    ''')
+
+
+def downgrade(db):
+    db.executescript('''
+        DROP TRIGGER IF EXISTS post_version_insert;
+        DROP TRIGGER IF EXISTS post_version_update;
+        DROP TRIGGER IF EXISTS post_version_delete;
+        DROP TABLE IF EXISTS post_version;
+    ''')
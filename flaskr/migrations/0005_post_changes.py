@@ -0,0 +1,65 @@
+'''
+The post.updated column and the post_change feed.
+
+SQLite can only add a column with a constant default, so updated is
+added as a nullable column and filled from created in batches. That is
+the one way a migrated database differs from one created by schema.sql:
+its updated column has no DEFAULT CURRENT_TIMESTAMP and isn't NOT NULL,
+and rebuilding post to add them would rewrite the whole table in one
+transaction. The statements in flaskr.queries that insert or update
+posts set updated themselves, so posts written by the app get it either
+way; rows inserted by hand without it are left with NULL.
+'''
+
+from flaskr.migrate import column_exists, in_batches
+
+
+def upgrade(db):
+    if not column_exists(db, 'post', 'updated'):
+        db.execute('ALTER TABLE post ADD COLUMN updated TIMESTAMP')
+
+    in_batches(
+        db, 'post',
+        'UPDATE post SET updated = created'
+        ' WHERE id BETWEEN ? AND ? AND updated IS NULL',
+    )
+
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS post_change (
+          seq INTEGER PRIMARY KEY AUTOINCREMENT,
+          post_id INTEGER UNIQUE NOT NULL,
+          deleted INTEGER NOT NULL DEFAULT 0,
+          changed TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TRIGGER IF NOT EXISTS post_change_insert AFTER INSERT ON post BEGIN
+          INSERT OR REPLACE INTO post_change (post_id) VALUES (new.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS post_change_update AFTER UPDATE ON post BEGIN
+          INSERT OR REPLACE INTO post_change (post_id) VALUES (new.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS post_change_delete AFTER DELETE ON post BEGIN
+          INSERT OR REPLACE INTO post_change (post_id, deleted) VALUES (old.id, 1);
+        END;
+    ''')
+
+    # every existing post starts out in the feed, oldest first
+    in_batches(
+        db, 'post',
+        'INSERT OR IGNORE INTO post_change (post_id, changed)'
+        ' SELECT id, updated FROM post WHERE id BETWEEN ? AND ? ORDER BY id',
+    )
+
+
+def downgrade(db):
+    db.executescript('''
+        DROP TRIGGER IF EXISTS post_change_insert;
+        DROP TRIGGER IF EXISTS post_change_update;
+        DROP TRIGGER IF EXISTS post_change_delete;
+        DROP TABLE IF EXISTS post_change;
+    ''')
+
+    if column_exists(db, 'post', 'updated'):
+        db.execute('ALTER TABLE post DROP COLUMN updated')
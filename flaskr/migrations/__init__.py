@@ -0,0 +1,6 @@
+'''
+
+Schema migrations, applied in order by flaskr.migrate. Each module is 
+named <version>_<name>.py and defines upgrade(db) and downgrade(db).
+
+'''
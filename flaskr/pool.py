@@ -0,0 +1,127 @@
+'''
+A small pool of reusable sqlite3 connections
+
+Opening a connection is not free: SQLite has to open the file, read and
+parse the schema and warm its page cache before the first query is
+answered. Without a pool, get_db pays that cost on every request and
+close_db throws the warmed connection away again at teardown.
+
+ConnectionPool keeps up to max_size idle connections around. A thread
+checks a connection out with acquire() and hands it back with release()
+when the request is torn down, so a connection is only ever used by one
+thread at a time even though it is created with check_same_thread=False.
+
+If every pooled connection is checked out, acquire() opens an extra one
+instead of blocking; release() closes it again if the pool is already
+full. This keeps the number of idle connections bounded without making
+requests wait on each other.
+
+Before an idle connection is handed out it gets a cheap health check,
+PRAGMA schema_version, which reads the database header from the file.
+A connection that fails it (for example because it was closed, or the
+file was overwritten with something that isn't a database) is discarded
+and a fresh one is opened. A file that was deleted or renamed and
+replaced by a new one isn't noticed, the connection keeps reading the
+old file; restart the workers after swapping the database file.
+
+The hits, misses and discarded counters show how often a request was
+served by a warm connection, how often a new one had to be opened and
+how many were thrown away by the health check.
+
+'''
+
+import sqlite3
+import threading
+
+
+class ConnectionPool(object):
+    def __init__(self, connect, max_size=5):
+        """Create a pool that opens connections by calling ``connect``.
+        :param connect: callable returning a new sqlite3 connection
+        :param max_size: maximum number of idle connections to keep
+        """
+        self._connect = connect
+        self.max_size = max_size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._in_use = {}
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def acquire(self):
+        """Check out a healthy connection for the current thread."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self.misses += 1
+                    break
+                conn = self._idle.pop()
+
+            if self._is_healthy(conn):
+                with self._lock:
+                    self.hits += 1
+                    self._in_use[id(conn)] = threading.get_ident()
+                return conn
+
+            with self._lock:
+                self.discarded += 1
+            conn.close()
+
+        conn = self._connect()
+        with self._lock:
+            self._in_use[id(conn)] = threading.get_ident()
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, or close it if the pool is
+        already full. Any transaction left open is rolled back so the
+        next request starts clean."""
+        with self._lock:
+            self._in_use.pop(id(conn), None)
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self.discarded += 1
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Return the pool counters as a dict."""
+        with self._lock:
+            return {
+                'size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+            }
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            # unlike SELECT 1, this reads the file
+            conn.execute('PRAGMA schema_version').fetchone()
+        except sqlite3.Error:
+            return False
+
+        return True
@@ -0,0 +1,229 @@
+'''
+Profiling requests in production
+
+With PROFILE enabled, some requests are profiled and the result of each
+one is written to its own file in PROFILE_DIR, the profiles folder in
+the instance folder by default. A request is profiled when
+
+    *   its endpoint is listed in PROFILE_ENDPOINTS, for example
+        ('blog.index', 'auth.login'),
+    *   PROFILE_HEADER names a header, for example 'X-Flaskr-Profile',
+        and the request carries it with PROFILE_SECRET as its value, or
+    *   otherwise, at random with the probability PROFILE_SAMPLE_RATE,
+        0.01 profiling about one request in a hundred.
+
+PROFILE_MODE picks how:
+
+    'sample'    A background thread looks at the request thread's
+                stack every PROFILE_INTERVAL_MS milliseconds. The stacks
+                are written as a .folded file, one "frame;frame;frame
+                count" line per distinct stack, the input format of
+                flamegraph.pl, speedscope and most other flame graph
+                tools. It costs little, since the request itself isn't
+                traced, and shows where the wall time goes, including
+                time spent waiting on SQLite or a hashing process.
+    'cprofile'  cProfile traces every function call of the request and
+                the stats are written as a .prof file, which pstats,
+                snakeviz and flameprof read. It is exact, but slows the
+                profiled request down considerably.
+
+Profiling starts before the request is dispatched and stops when the
+request is torn down, so a streamed response is profiled until its last
+chunk. Only one cProfile can run on a thread at a time; if another
+profiler is already active, the request runs without one.
+
+The header is ignored unless PROFILE_SECRET is set too. Profiling and
+writing a file costs far more than serving the request, so anybody who
+could ask for it on every request could slow the site down and fill
+the disk.
+
+The file names start with the time and the endpoint, followed by the
+duration, for example 20240101-120000-123456-blog.index-153ms.folded.
+After every write the oldest files are deleted until there are at most
+PROFILE_MAX_FILES of them and they take at most PROFILE_MAX_BYTES.
+
+'''
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+
+
+class StackSampler(object):
+    """Samples the stack of one thread from a background thread."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='flaskr-profiler', daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+
+    def dump(self, path):
+        """Write the stacks in the collapsed format of flamegraph.pl."""
+        with open(path, 'w', encoding='utf8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def _fold(frame):
+    names = []
+
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f'{code.co_name} ({os.path.basename(code.co_filename)}'
+            f':{code.co_firstlineno})'
+        )
+        frame = frame.f_back
+
+    # outermost frame first; ';' separates the frames in folded stacks
+    return ';'.join(reversed(names))
+
+
+class CProfiler(object):
+    def __init__(self):
+        # imported here, cProfile is only needed when a request is
+        # actually profiled
+        import cProfile
+
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+def should_profile(config):
+    if request.endpoint in config['PROFILE_ENDPOINTS']:
+        return True
+
+    header = config['PROFILE_HEADER']
+    secret = config['PROFILE_SECRET']
+
+    if header and secret and hmac.compare_digest(
+        request.headers.get(header, '').encode('utf8'), secret.encode('utf8')
+    ):
+        return True
+
+    return random.random() < config['PROFILE_SAMPLE_RATE']
+
+
+def get_profile_dir(app):
+    return app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+
+
+def start_profile():
+    config = current_app.config
+
+    if not should_profile(config):
+        return
+
+    if config['PROFILE_MODE'] == 'cprofile':
+        profiler = CProfiler()
+    else:
+        profiler = StackSampler(
+            threading.get_ident(), config['PROFILE_INTERVAL_MS'] / 1000
+        )
+
+    try:
+        profiler.start()
+    except ValueError:
+        # another profiler, e.g. a debugger or a coverage tool, is
+        # already active on this thread
+        current_app.logger.debug('Not profiling %s, another profiler is '
+                                 'active.', request.endpoint)
+        return
+
+    g.profile = (profiler, time.perf_counter())
+
+
+def stop_profile(exc=None):
+    profile = g.pop('profile', None)
+
+    if profile is None:
+        return
+
+    profiler, start = profile
+    profiler.stop()
+    elapsed = time.perf_counter() - start
+    app = current_app._get_current_object()
+    directory = get_profile_dir(app)
+    ext = '.prof' if isinstance(profiler, CProfiler) else '.folded'
+    name = (
+        f'{datetime.now():%Y%m%d-%H%M%S-%f}-{request.endpoint or "none"}'
+        f'-{elapsed * 1000:.0f}ms{ext}'
+    )
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump(os.path.join(directory, name))
+        prune(directory, app.config['PROFILE_MAX_FILES'],
+              app.config['PROFILE_MAX_BYTES'])
+    except OSError as e:
+        # a full disk shouldn't fail the request that was profiled
+        app.logger.warning('Could not write profile %s: %s', name, e)
+    else:
+        app.logger.debug('Wrote profile %s', name)
+
+
+def prune(directory, max_files, max_bytes):
+    """Delete the oldest profiles until at most ``max_files`` files
+    taking at most ``max_bytes`` are left."""
+    files = []
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(('.prof', '.folded')):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+    files.sort()
+    total = sum(size for _, _, size in files)
+
+    while files and (len(files) > max_files or total > max_bytes):
+        _, name, size = files.pop(0)
+
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # another worker pruned it first
+            pass
+
+        total -= size
+
+
+def init_app(app):
+    if not app.config['PROFILE']:
+        return
+
+    app.before_request(start_profile)
+    app.teardown_request(stop_profile)
@@ -0,0 +1,233 @@
+'''
+Named SQL statements
+
+Every statement the blog, auth and transfer modules run is registered
+in QUERIES under a name like 'post.by_id', and they run it by name with
+run(db, 'post.by_id', (id,)), or run_many() for executemany(), instead
+of repeating the SQL inline. Statements whose WHERE clause depends on
+the arguments get one name per variant, like 'post.page_after'. That
+keeps each statement in one place, where it can be read, changed and
+compared against its query plan without searching the views for copies.
+
+sqlite3 keeps a cache of compiled statements on every connection, so a
+statement that is executed again skips parsing and planning. connect()
+sizes that cache with statement_cache_size(), which leaves room for
+every registered statement on top of sqlite3's default of 128, so the
+registry never pushes its own statements out of the cache.
+
+run() also counts the calls, errors and time of each statement in the
+app's QueryStats, get_stats(app).snapshot() returns them, and the
+benchmark script includes them in its results. The time is spent in
+execute(), which for a SELECT includes finding the first row but not
+fetching the rest. flask queries prints every statement with its query
+plan and the counts collected so far.
+
+'''
+
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+_post = (
+    'SELECT p.id, title, body, created, author_id, username'
+    ' FROM post p JOIN user u ON p.author_id = u.id'
+)
+
+_search = (
+    'SELECT p.id, p.title, created, author_id, username, post_fts.rank,'
+    " snippet(post_fts, -1, char(2), char(3), '…', 24) AS snippet"
+    ' FROM post_fts'
+    ' JOIN post p ON p.id = post_fts.rowid'
+    ' JOIN user u ON p.author_id = u.id'
+    ' WHERE post_fts MATCH ?'
+)
+
+_export = (
+    'SELECT p.id, title, body, created, updated, author_id, username'
+    ' FROM post p JOIN user u ON p.author_id = u.id'
+)
+
+QUERIES = {
+    'post.page': _post + ' ORDER BY created DESC, p.id DESC LIMIT ?',
+    'post.page_after': _post + ' WHERE (created, p.id) < (?, ?)'
+                       ' ORDER BY created DESC, p.id DESC LIMIT ?',
+    # walks the index forwards, the caller reverses the rows
+    'post.page_before': _post + ' WHERE (created, p.id) > (?, ?)'
+                        ' ORDER BY created ASC, p.id ASC LIMIT ?',
+    'post.by_id': _post + ' WHERE p.id = ?',
+    'post.version': 'SELECT version, modified FROM post_version',
+    'post.change_seq': 'SELECT seq FROM post_change WHERE post_id = ?',
+    'post.search': _search + ' ORDER BY post_fts.rank, p.id LIMIT ?',
+    'post.search_after': _search + ' AND (post_fts.rank, p.id) > (?, ?)'
+                         ' ORDER BY post_fts.rank, p.id LIMIT ?',
+    # updated is set by the statements rather than by triggers, whose
+    # second UPDATE of the row would fire the change triggers again, and
+    # a migrated database has no default for it
+    'post.insert': 'INSERT INTO post (title, body, author_id, updated)'
+                   ' VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+    'post.update': 'UPDATE post SET title = ?, body = ?,'
+                   ' updated = CURRENT_TIMESTAMP WHERE id = ?',
+    'post.delete': 'DELETE FROM post WHERE id = ?',
+    # updated is set explicitly, a fresh schema would default it to the
+    # time of the import and a migrated one has no default
+    'post.import': 'INSERT INTO post (title, body, author_id, created, updated)'
+                   ' SELECT ?, ?, ?, t, t'
+                   ' FROM (SELECT COALESCE(?, CURRENT_TIMESTAMP) AS t)',
+    'post.export': _export + ' ORDER BY created, p.id LIMIT ?',
+    'post.export_since': _export + ' WHERE created >= ?'
+                         ' ORDER BY created, p.id LIMIT ?',
+    'post.export_until': _export + ' WHERE created < ?'
+                         ' ORDER BY created, p.id LIMIT ?',
+    'post.export_range': _export + ' WHERE created >= ? AND created < ?'
+                         ' ORDER BY created, p.id LIMIT ?',
+    # the chunks after the first continue from the last (created, id)
+    'post.export_after': _export + ' WHERE (created, p.id) > (?, ?)'
+                         ' ORDER BY created, p.id LIMIT ?',
+    'post.export_after_until': _export + ' WHERE (created, p.id) > (?, ?)'
+                               ' AND created < ? ORDER BY created, p.id LIMIT ?',
+    # a LIMIT of -1 means no limit
+    'post.changes': 'SELECT c.seq, c.post_id, c.deleted, c.changed, title,'
+                    ' body, created, updated, author_id, username'
+                    ' FROM post_change c'
+                    ' LEFT JOIN post p ON p.id = c.post_id'
+                    ' LEFT JOIN user u ON u.id = p.author_id'
+                    ' WHERE c.seq > ? ORDER BY c.seq LIMIT ?',
+    'post.deferrable': "SELECT type, name, sql FROM sqlite_master"
+                       " WHERE tbl_name = 'post' AND sql IS NOT NULL"
+                       " AND (type = 'index'"
+                       " OR type = 'trigger' AND name GLOB 'post_fts_*')",
+    'db.journal_mode': 'PRAGMA journal_mode',
+    'post_fts.exists': "SELECT 1 FROM sqlite_master WHERE name = 'post_fts'",
+    'post_fts.rebuild': "INSERT INTO post_fts (post_fts) VALUES ('rebuild')",
+    'user.by_id': 'SELECT * FROM user WHERE id = ?',
+    # what g.user needs, without the password hash that would end up
+    # in the user cache
+    'user.session': 'SELECT id, username FROM user WHERE id = ?',
+    'user.by_username': 'SELECT * FROM user WHERE username = ?',
+    'user.id_by_username': 'SELECT id FROM user WHERE username = ?',
+    'user.insert': 'INSERT INTO user (username, password) VALUES (?, ?)',
+    'user.set_password': 'UPDATE user SET password = ? WHERE id = ?',
+}
+
+
+def statement_cache_size():
+    """Size of the sqlite3 statement cache for new connections."""
+    return len(QUERIES) + 128
+
+
+class QueryStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, seconds, error=False):
+        with self._lock:
+            stats = self._stats.get(name)
+
+            if stats is None:
+                stats = self._stats[name] = {
+                    'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                }
+
+            stats['calls'] += 1
+            stats['errors'] += error
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def snapshot(self):
+        """Copy the stats of every statement that has run, by name."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def get_stats(app=None):
+    """Get the per-statement stats of an app."""
+    if app is None:
+        app = current_app._get_current_object()
+
+    stats = app.extensions.get('flaskr.query_stats')
+
+    if stats is None:
+        stats = app.extensions.setdefault('flaskr.query_stats', QueryStats())
+
+    return stats
+
+
+def _run(execute, name, parameters, stats):
+    sql = QUERIES[name]
+
+    if stats is None:
+        stats = get_stats()
+
+    start = time.perf_counter()
+
+    try:
+        cursor = execute(sql, parameters)
+    except Exception:
+        stats.record(name, time.perf_counter() - start, error=True)
+        raise
+
+    stats.record(name, time.perf_counter() - start)
+    return cursor
+
+
+def run(db, name, parameters=(), stats=None):
+    """Execute a registered statement and record its time.
+    :param db: the connection to execute it on
+    :param name: key of the statement in :data:`QUERIES`
+    :param stats: the :class:`QueryStats` to record in, by default the
+        current app's
+    :return: the cursor
+    :raise KeyError: if no statement has that name
+    """
+    return _run(db.execute, name, parameters, stats)
+
+
+def run_many(db, name, seq_of_parameters, stats=None):
+    """Execute a registered statement once for every set of parameters
+    with ``executemany()`` and record the time of all of them as one
+    call.
+    :return: the cursor
+    :raise KeyError: if no statement has that name
+    """
+    return _run(db.executemany, name, seq_of_parameters, stats)
+
+
+@click.command('queries')
+@with_appcontext
+def queries_command():
+    """Show every registered statement with its query plan."""
+    # imported here to avoid a circular import, db sizes its statement
+    # cache from this module
+    from flaskr.db import get_read_db
+
+    db = get_read_db()
+    stats = get_stats().snapshot()
+
+    for name, sql in QUERIES.items():
+        click.echo(f'{name}: {sql}')
+
+        if not sql.startswith(('INSERT', 'UPDATE', 'DELETE')):
+            # the plan doesn't depend on the values of the parameters
+            parameters = (None,) * sql.count('?')
+
+            for row in db.execute('EXPLAIN QUERY PLAN ' + sql, parameters):
+                click.echo(f'    {row["detail"]}')
+
+        if name in stats:
+            calls = stats[name]['calls']
+            click.echo(
+                f'    {calls} calls,'
+                f' {stats[name]["seconds"] / calls * 1000:.3f}ms average'
+            )
+
+
+def init_app(app):
+    app.cli.add_command(queries_command)
@@ -0,0 +1,225 @@
+'''
+Per-request SQL instrumentation
+
+While SQL_INSTRUMENT or SERVER_TIMING is enabled, every connection made
+by flaskr.db.connect() is an InstrumentedConnection. Its cursors time
+each statement and count the rows that are fetched from it. While a
+connection has a QueryLog attached as its log attribute, every
+statement is recorded there with the SQL text, the shape of its
+parameters (their count and types, never the values), the number of
+rows and the wall time. Without a log the wrappers only add a method
+call, but that is a Python call for every row fetched, so with both
+settings disabled connect() makes plain sqlite3 connections instead.
+
+With SQL_INSTRUMENT enabled, get_db attaches the QueryLog of the current
+request, kept on g.query_log, to the connection it hands out. When the
+request is finished, the log's summary is added to the response as the
+X-SQL-Queries and X-SQL-Time (milliseconds) headers and written to the
+debug log. SERVER_TIMING attaches the log too, for its db timing (see
+flaskr.timing), but only SQL_INSTRUMENT adds these headers. Two kinds
+of problems are logged as warnings:
+
+    *   a statement that took longer than SQL_SLOW_QUERY_MS
+    *   the same SQL executed SQL_N_PLUS_ONE_THRESHOLD or more times in
+        one request, which usually means a query runs in a loop over the
+        results of another one (the N+1 pattern)
+
+'''
+
+import sqlite3
+import time
+from collections import Counter
+
+from flask import current_app, g
+
+
+class QueryLog(object):
+    def __init__(self):
+        self.queries = []
+
+    def record(self, sql, params, rows, seconds):
+        entry = {
+            'sql': sql,
+            'params': _shape(params),
+            'rows': rows,
+            'seconds': seconds,
+        }
+        self.queries.append(entry)
+        return entry
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def seconds(self):
+        return sum(query['seconds'] for query in self.queries)
+
+    def slow(self, threshold):
+        """Queries that took longer than ``threshold`` seconds."""
+        return [query for query in self.queries if query['seconds'] > threshold]
+
+    def repeated(self, threshold):
+        """SQL executed at least ``threshold`` times, with the count."""
+        counts = Counter(query['sql'] for query in self.queries)
+        return [(sql, n) for sql, n in counts.most_common() if n >= threshold]
+
+
+def _shape(params):
+    if params is None:
+        return ()
+
+    if isinstance(params, dict):
+        return tuple(f'{key}:{type(value).__name__}'
+                     for key, value in params.items())
+
+    if isinstance(params, (list, tuple)):
+        return tuple(type(value).__name__ for value in params)
+
+    # executemany parameters, only the number of rows is known up front
+    return ('many',)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    log = None
+    _entry = None
+
+    def execute(self, sql, parameters=()):
+        if self.log is None:
+            return super().execute(sql, parameters)
+
+        start = time.perf_counter()
+
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._entry = self.log.record(
+                sql, parameters, max(self.rowcount, 0),
+                time.perf_counter() - start,
+            )
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.log is None:
+            return super().executemany(sql, seq_of_parameters)
+
+        start = time.perf_counter()
+
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._entry = self.log.record(
+                sql, seq_of_parameters, max(self.rowcount, 0),
+                time.perf_counter() - start,
+            )
+
+    def executescript(self, sql_script):
+        if self.log is None:
+            return super().executescript(sql_script)
+
+        start = time.perf_counter()
+
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._entry = self.log.record(
+                sql_script, None, 0, time.perf_counter() - start
+            )
+
+    def _fetched(self, rows, start):
+        # SELECT statements step through their results as rows are
+        # fetched, so the fetch time belongs to the statement too
+        if self._entry is not None:
+            self._entry['rows'] += rows
+            self._entry['seconds'] += time.perf_counter() - start
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(row is not None, start)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), start)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(0, start)
+            raise
+
+        self._fetched(1, start)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    log = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        cursor = super().cursor(factory)
+        cursor.log = self.log
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def is_enabled(config):
+    """Whether connections should be instrumented for this config."""
+    return bool(config['SQL_INSTRUMENT'] or config['SERVER_TIMING'])
+
+
+def get_query_log():
+    """Get the query log of the current request, or ``None`` if both
+    ``SQL_INSTRUMENT`` and ``SERVER_TIMING`` are disabled."""
+    if not is_enabled(current_app.config):
+        return None
+
+    if 'query_log' not in g:
+        g.query_log = QueryLog()
+
+    return g.query_log
+
+
+def report_queries(response):
+    log = g.get('query_log')
+    config = current_app.config
+
+    if log is None or not config['SQL_INSTRUMENT']:
+        return response
+
+    logger = current_app.logger
+    response.headers['X-SQL-Queries'] = str(log.count)
+    response.headers['X-SQL-Time'] = f'{log.seconds * 1000:.3f}'
+    logger.debug('%d queries in %.3fms', log.count, log.seconds * 1000)
+
+    for query in log.slow(config['SQL_SLOW_QUERY_MS'] / 1000):
+        logger.warning('Slow query (%.3fms, %d rows): %s',
+                       query['seconds'] * 1000, query['rows'], query['sql'])
+
+    for sql, n in log.repeated(config['SQL_N_PLUS_ONE_THRESHOLD']):
+        logger.warning('Query executed %d times in one request, possible '
+                       'N+1: %s', n, sql)
+
+    return response
+
+
+def init_app(app):
+    app.after_request(report_queries)
@@ -4,12 +4,20 @@ In SQLite, data is stored in tables and columns. These need to be
 created before you can store and retrieve data. Flaskr will store 
 users in the user table, and posts in the post table
 
+This file always creates the latest schema. Databases that already 
+hold data are changed with the migrations in flaskr/migrations instead, 
+see flaskr/migrate.py. Any change made here needs a migration too.
+
 
 */
 
 
 
 
+DROP TABLE IF EXISTS post_fts;
+DROP TABLE IF EXISTS post_version;
+DROP TABLE IF EXISTS post_change;
+DROP TABLE IF EXISTS schema_migrations;
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
 
@@ -23,7 +31,82 @@ CREATE TABLE post (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   author_id INTEGER NOT NULL,
   created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   title TEXT NOT NULL,
   body TEXT NOT NULL,
   FOREIGN KEY (author_id) REFERENCES user (id)
-);
\ No newline at end of file
+);
+
+-- the index lists posts newest first and pages through them by seeking
+-- to a (created, id) position, which this index answers directly
+CREATE INDEX post_created_id ON post (created, id);
+
+-- full text index over post titles and bodies for /search. It is an
+-- external content table, so the text is only stored once, in post,
+-- and the triggers below keep the index in step with every write
+CREATE VIRTUAL TABLE post_fts USING fts5(
+  title,
+  body,
+  content='post',
+  content_rowid='id'
+);
+
+CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body)
+  VALUES ('delete', old.id, old.title, old.body);
+END;
+
+CREATE TRIGGER post_fts_update AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body)
+  VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+-- a counter bumped by every write to post, so views can tell whether
+-- anything changed since a client's cached copy with one row lookup
+CREATE TABLE post_version (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL,
+  modified TIMESTAMP NOT NULL
+);
+
+INSERT INTO post_version (id, version, modified) VALUES (1, 0, CURRENT_TIMESTAMP);
+
+CREATE TRIGGER post_version_insert AFTER INSERT ON post BEGIN
+  UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER post_version_update AFTER UPDATE ON post BEGIN
+  UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER post_version_delete AFTER DELETE ON post BEGIN
+  UPDATE post_version SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+-- the change feed: one row per post that was ever written, numbered by
+-- the order of its latest change. Replacing the row on every write
+-- keeps the table the size of post, and deleted posts stay behind as
+-- tombstones so incremental readers learn about them
+CREATE TABLE post_change (
+  seq INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER UNIQUE NOT NULL,
+  deleted INTEGER NOT NULL DEFAULT 0,
+  changed TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER post_change_insert AFTER INSERT ON post BEGIN
+  INSERT OR REPLACE INTO post_change (post_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER post_change_update AFTER UPDATE ON post BEGIN
+  INSERT OR REPLACE INTO post_change (post_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER post_change_delete AFTER DELETE ON post BEGIN
+  INSERT OR REPLACE INTO post_change (post_id, deleted) VALUES (old.id, 1);
+END;
\ No newline at end of file
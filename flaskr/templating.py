@@ -0,0 +1,191 @@
+'''
+Compiled template cache and warm-up
+
+Jinja compiles a template to Python code the first time it is loaded,
+which takes a few milliseconds per template, and every worker process
+does it again for itself. After a deploy or a worker restart the first
+requests of every worker pay for it.
+
+Two things avoid that:
+
+    *   A FileSystemBytecodeCache in TEMPLATE_CACHE_DIR, the jinja_cache
+        folder in the instance folder by default, keeps the compiled
+        code of every template on disk. A worker loading a template
+        checks the cache first and only compiles the template when its
+        source has changed. flask compile-templates fills the cache
+        ahead of time, for example as a deploy step, and --clear drops
+        what was there before. It also creates the folder, templates
+        compiled while serving are only cached once it exists.
+
+    *   With TEMPLATE_WARMUP, create_app() loads every template once, so
+        they are in Jinja's in-memory cache before the first request.
+        Under a pre-fork server that loads the app before forking, the
+        workers inherit the loaded templates.
+
+Both default to on unless the app is testing; TEMPLATE_BYTECODE_CACHE
+and TEMPLATE_WARMUP set them explicitly.
+
+get_build_id() identifies the templates and static files a worker
+serves: the BUILD_ID config if a deploy sets one, otherwise a hash of
+every template source and of the assets manifest. Anything derived from
+a rendered page, such as the page cache key and the ETag, includes it,
+so a deploy never serves HTML rendered by the templates it replaced.
+get_build_time() is the last change to those files, which a
+Last-Modified header can't be older than. Both are worked out once per
+process, like the manifest.
+
+'''
+
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from datetime import timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """A FileSystemBytecodeCache that only writes to a folder that
+    already exists and never fails a render because it couldn't write."""
+
+    def dump_bytecode(self, bucket):
+        # the folder is created by compile-templates, a worker that
+        # just renders doesn't leave one behind
+        if not os.path.isdir(self.directory):
+            return
+
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            # the template is compiled either way, it just isn't cached
+            pass
+
+
+def get_cache_dir(app):
+    return (app.config['TEMPLATE_CACHE_DIR']
+            or os.path.join(app.instance_path, 'jinja_cache'))
+
+
+def get_build_id(app=None):
+    """Get the identifier of the templates and assets an app serves."""
+    if app is None:
+        app = current_app._get_current_object()
+
+    build_id = app.extensions.get('flaskr.build_id')
+
+    if build_id is None:
+        build_id = app.config['BUILD_ID']
+
+        if build_id is None:
+            # imported here to keep the modules independent at import
+            from flaskr.assets import get_manifest
+
+            env = app.jinja_env
+            h = hashlib.sha1(
+                json.dumps(get_manifest(app), sort_keys=True).encode('utf8')
+            )
+
+            for name in env.list_templates():
+                h.update(name.encode('utf8'))
+                h.update(env.loader.get_source(env, name)[0].encode('utf8'))
+
+            build_id = h.hexdigest()[:12]
+
+        build_id = app.extensions.setdefault('flaskr.build_id', str(build_id))
+
+    return build_id
+
+
+def get_build_time(app=None):
+    """Get when the templates or the assets manifest of an app last
+    changed, as an aware UTC datetime in whole seconds."""
+    if app is None:
+        app = current_app._get_current_object()
+
+    build_time = app.extensions.get('flaskr.build_time')
+
+    if build_time is None:
+        from flaskr.assets import get_assets_dir
+
+        env = app.jinja_env
+        paths = [os.path.join(get_assets_dir(app), 'manifest.json')]
+        paths += [env.loader.get_source(env, name)[1]
+                  for name in env.list_templates()]
+        mtime = max(
+            (os.path.getmtime(path) for path in paths
+             if path is not None and os.path.exists(path)),
+            default=0,
+        )
+        build_time = app.extensions.setdefault(
+            'flaskr.build_time',
+            datetime.fromtimestamp(int(mtime), timezone.utc),
+        )
+
+    return build_time
+
+
+def _enabled(app, name):
+    value = app.config[name]
+    return not app.testing if value is None else value
+
+
+def warm_up(app):
+    """Load every template of an app into Jinja's cache.
+    :return: the number of templates loaded
+    """
+    env = app.jinja_env
+    names = env.list_templates(extensions=('html',))
+
+    for name in names:
+        env.get_template(name)
+
+    return len(names)
+
+
+@click.command('compile-templates')
+@click.option('--clear', is_flag=True,
+              help='Drop the cached templates before compiling.')
+@with_appcontext
+def compile_templates_command(clear):
+    """Compile all templates into the bytecode cache."""
+    app = current_app._get_current_object()
+    cache = app.jinja_env.bytecode_cache
+
+    if cache is None:
+        raise click.ClickException('The template bytecode cache is disabled.')
+
+    os.makedirs(cache.directory, exist_ok=True)
+
+    if clear:
+        cache.clear()
+
+    # templates warmed up by create_app() are already loaded, load them
+    # again through the bytecode cache
+    if app.jinja_env.cache is not None:
+        app.jinja_env.cache.clear()
+
+    start = time.perf_counter()
+    count = warm_up(app)
+    click.echo(
+        f'Compiled {count} templates into {cache.directory} in'
+        f' {(time.perf_counter() - start) * 1000:.0f}ms.'
+    )
+
+
+def init_app(app):
+    if _enabled(app, 'TEMPLATE_BYTECODE_CACHE'):
+        # jinja_env is created on first use, from jinja_options
+        app.jinja_options = {
+            **app.jinja_options,
+            'bytecode_cache': BytecodeCache(get_cache_dir(app)),
+        }
+
+    app.cli.add_command(compile_templates_command)
+
+    if _enabled(app, 'TEMPLATE_WARMUP'):
+        warm_up(app)
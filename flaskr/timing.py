@@ -0,0 +1,119 @@
+'''
+Server-Timing breakdown of each request
+
+With SERVER_TIMING enabled, every response carries a Server-Timing
+header that splits the time spent on the request into categories,
+which browser devtools show in the network panel and load balancers
+can log:
+
+    Server-Timing: db;desc="3 queries";dur=1.204, template;dur=3.870,
+        hash;dur=0.000, session;dur=0.061, total;dur=6.532
+
+The durations are in milliseconds.
+
+    db          statements executed on get_db and get_read_db
+                connections, timed by their QueryLog (see
+                flaskr.querylog), plus the time spent waiting for the
+                writer thread when WRITE_QUEUE is enabled
+    template    render_template calls, between the before_render_template
+                and template_rendered signals. Pages streamed with
+                stream_template are rendered while the response is sent,
+                after the header is final, and aren't included.
+    hash        password hashes and checks by the PasswordHasher
+    session     loading the session cookie. Flask saves the session after
+                the header has been added, so saving isn't included.
+    total       from opening the session, the first thing Flask does for
+                a request, until the header is added
+
+Other modules add to a category with add_time(), which does nothing
+outside of a request or when SERVER_TIMING is disabled.
+
+'''
+
+import time
+
+from flask import before_render_template
+from flask import g
+from flask import has_request_context
+from flask import template_rendered
+
+CATEGORIES = ('db', 'template', 'hash', 'session')
+
+
+def add_time(category, seconds):
+    """Add ``seconds`` to a category of the current request."""
+    if has_request_context() and 'server_timing' in g:
+        g.server_timing[category] += seconds
+
+
+class TimedSessionInterface(object):
+    """Wraps a session interface to time loading the session."""
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def __getattr__(self, name):
+        return getattr(self.interface, name)
+
+    def open_session(self, app, request):
+        start = time.perf_counter()
+        g.server_timing = dict.fromkeys(CATEGORIES, 0.0)
+        g.server_timing_start = start
+
+        try:
+            return self.interface.open_session(app, request)
+        finally:
+            add_time('session', time.perf_counter() - start)
+
+
+def _template_started(app, template, context, **extra):
+    if 'server_timing' in g:
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+
+def _template_rendered(app, template, context, **extra):
+    starts = g.get('template_starts')
+
+    if starts:
+        # a template rendered by another one's render_template is
+        # already part of the outer one's time
+        start = starts.pop()
+
+        if not starts:
+            add_time('template', time.perf_counter() - start)
+
+
+def add_header(response):
+    timings = g.get('server_timing')
+
+    if timings is None:
+        return response
+
+    log = g.get('query_log')
+    parts = []
+
+    for category in CATEGORIES:
+        seconds = timings[category]
+
+        if category == 'db' and log is not None:
+            seconds += log.seconds
+            parts.append(
+                f'db;desc="{log.count} queries";dur={seconds * 1000:.3f}'
+            )
+        else:
+            parts.append(f'{category};dur={seconds * 1000:.3f}')
+
+    total = time.perf_counter() - g.server_timing_start
+    parts.append(f'total;dur={total * 1000:.3f}')
+    response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+
+def init_app(app):
+    if not app.config['SERVER_TIMING']:
+        return
+
+    app.session_interface = TimedSessionInterface(app.session_interface)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+    app.after_request(add_header)
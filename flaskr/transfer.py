@@ -0,0 +1,514 @@
+'''
+Bulk import and export of posts
+
+flask import-posts reads posts from one or more JSONL or CSV files and
+inserts them in large batches. Each record needs a title and either an
+author (a username) or an author_id; body and created are optional.
+created is an ISO 8601 date or time, stored in UTC like the times of
+posts written through the app.
+
+    {"title": "Hello", "body": "...", "author": "test", "created": "2018-01-01 00:00:00"}
+
+Files are read one record at a time, so their size doesn't matter. The
+records are collected into batches of --batch-size rows, and each batch
+is inserted with a single executemany() and committed as one
+transaction. Committing once per row would make SQLite sync the journal
+for every post; once per batch turns millions of syncs into hundreds.
+
+With --defer-indexes the indexes on post and the full text index
+triggers are dropped before the import and created again at the end,
+and the full text index is rebuilt in one pass. That is much faster
+than updating every index for every row, but searches won't find the
+new posts until the import is done. The triggers that record changes
+and bump the post version stay, so caches and syncing clients see
+every post the import and the app write meanwhile.
+
+Files ending in .gz are decompressed on the fly, and - reads standard
+input. The format is taken from the file extension unless --format is
+given.
+
+flask export-posts and the /export.jsonl view go the other way. They
+write every post joined with its author's username as one JSON object
+per line. The rows are read in chunks of EXPORT_CHUNK_SIZE, each one a
+separate query that continues from the (created, id) of the last row
+of the previous chunk, and written out as they arrive, so exporting a
+database of any size takes the same small amount of memory. Since no
+statement is left open between chunks, writes aren't blocked by the
+export even without WAL. With --gzip, or
+?gzip=1 for the view, the output is compressed as it is produced.
+--since and --until limit the export to posts created in that range,
+which the (created, id) index answers without a full scan.
+
+The view is only available to logged in users and is streamed with
+stream_with_context, which keeps the request, and the database
+read connection, alive until the last line has been sent.
+
+For incremental syncs, /changes?since=<seq> and flask changes --since
+return only the posts created, edited or deleted after a cursor. The
+post_change table, kept up to date by triggers, holds one row per post
+with the sequence number of its latest change; deleted posts stay in it
+as tombstones. A client stores the last seq it has seen and asks for
+the changes after it next time, instead of reading every post again.
+The view returns at most CHANGES_PAGE_SIZE changes per request with
+the cursor for the next one.
+
+'''
+
+import json
+import time
+import zlib
+from datetime import datetime
+from datetime import timezone
+
+import click
+from flask import Blueprint
+from flask import current_app
+from flask import Response
+from flask import request
+from flask import stream_with_context
+from flask.cli import with_appcontext
+from werkzeug.exceptions import abort
+
+from flaskr.auth import login_required
+from flaskr.db import fits_integer
+from flaskr.db import get_db
+from flaskr.db import get_read_db
+from flaskr.queries import run
+from flaskr.queries import run_many
+
+bp = Blueprint('transfer', __name__)
+
+
+def read_records(f, format):
+    """Yield records as dicts from a text file, with their line number."""
+    if format == 'jsonl':
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise click.ClickException(f'line {number}: {e}')
+
+                if not isinstance(record, dict):
+                    raise click.ClickException(
+                        f'line {number}: expected a JSON object.'
+                    )
+
+                yield number, record
+    else:
+        # imported here since only the csv format needs it
+        import csv
+
+        # line 1 is the header
+        for number, row in enumerate(csv.DictReader(f), 2):
+            yield number, row
+
+
+def open_input(path, format):
+    """Open a file for reading as text and work out its format."""
+    name = path[:-3] if path.endswith('.gz') else path
+
+    if format is None:
+        format = 'csv' if name.endswith('.csv') else 'jsonl'
+
+    if path == '-':
+        return click.open_file(path, encoding='utf8'), format
+
+    if path.endswith('.gz'):
+        import gzip
+
+        return gzip.open(path, 'rt', encoding='utf8', newline=''), format
+
+    return open(path, encoding='utf8', newline=''), format
+
+
+def drop_post_indexes(db):
+    """Drop the indexes and full text index triggers on post. The
+    triggers that keep ``post_change`` and ``post_version`` current
+    stay, so readers and syncing clients see the imported posts as
+    they are committed.
+    :return: the statements that create them again
+    """
+    objects = run(db, 'post.deferrable').fetchall()
+
+    for object in objects:
+        db.execute(f'DROP {object["type"]} "{object["name"]}"')
+
+    db.commit()
+    return [object['sql'] for object in objects]
+
+
+def restore_post_indexes(db, statements):
+    """Create the indexes and triggers dropped by
+    :func:`drop_post_indexes` again and rebuild the full text index,
+    which missed the posts inserted without its triggers.
+    """
+    for sql in statements:
+        db.execute(sql)
+
+    if run(db, 'post_fts.exists').fetchone() is not None:
+        run(db, 'post_fts.rebuild')
+
+    db.commit()
+
+
+def to_utc(value):
+    """Convert an aware datetime to the naive UTC time SQLite's
+    ``CURRENT_TIMESTAMP`` stores. Naive datetimes are taken as UTC."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return value
+
+
+def parse_created(number, value):
+    """Parse the ``created`` time of an imported record into the format
+    SQLite's ``CURRENT_TIMESTAMP`` uses, which is what the ``timestamp``
+    converter reads back. Times with an offset are converted to UTC.
+    :return: the normalized string, or ``None`` if the record has none
+    :raise ClickException: naming the line, if the value isn't a date
+    """
+    if value in (None, ''):
+        return None
+
+    try:
+        created = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise click.ClickException(
+            f'line {number}: invalid created time {value!r}.'
+        )
+
+    return to_utc(created).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def import_posts(records, batch_size=10000, progress=None):
+    """Insert posts from an iterable of ``(line, record)`` pairs.
+    :param records: pairs as produced by :func:`read_records`
+    :param batch_size: number of rows to insert per transaction
+    :param progress: called with the total number of rows after every
+        committed batch
+    :return: the number of posts inserted
+    """
+    db = get_db()
+    authors = {}
+    author_ids = set()
+    batch = []
+    total = 0
+
+    def author_id(number, record):
+        if record.get('author_id') not in (None, ''):
+            value = record['author_id']
+
+            try:
+                id = int(value)
+            except (TypeError, ValueError, OverflowError):
+                id = None
+
+            if id is None or not fits_integer(id):
+                raise click.ClickException(
+                    f'line {number}: invalid author_id {value!r}.'
+                )
+
+            # foreign keys aren't enforced, and a post without its user
+            # would be missing from every view that joins on it
+            if id not in author_ids:
+                if run(db, 'user.by_id', (id,)).fetchone() is None:
+                    raise click.ClickException(
+                        f'line {number}: unknown author_id {value!r}.'
+                    )
+
+                author_ids.add(id)
+
+            return id
+
+        username = record.get('author')
+
+        if username not in authors:
+            user = run(db, 'user.id_by_username', (username,)).fetchone()
+
+            if user is None:
+                raise click.ClickException(
+                    f'line {number}: unknown author {username!r}.'
+                )
+
+            authors[username] = user['id']
+
+        return authors[username]
+
+    def flush():
+        run_many(db, 'post.import', batch)
+        db.commit()
+        batch.clear()
+
+    for number, record in records:
+        if not record.get('title'):
+            raise click.ClickException(f'line {number}: title is required.')
+
+        batch.append((
+            record['title'],
+            record.get('body') or '',
+            author_id(number, record),
+            parse_created(number, record.get('created')),
+        ))
+
+        if len(batch) >= batch_size:
+            total += len(batch)
+            flush()
+
+            if progress is not None:
+                progress(total)
+
+    if batch:
+        total += len(batch)
+        flush()
+
+    return total
+
+
+@click.command('import-posts')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--format', type=click.Choice(['jsonl', 'csv']),
+              help='Input format, guessed from the file name by default.')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Rows inserted per transaction.')
+@click.option('--defer-indexes', is_flag=True,
+              help='Drop the indexes on post during the import.')
+@with_appcontext
+def import_posts_command(paths, format, batch_size, defer_indexes):
+    """Import posts from JSONL or CSV files."""
+    db = get_db()
+    statements = drop_post_indexes(db) if defer_indexes else []
+    start = time.perf_counter()
+    total = 0
+
+    def progress(count):
+        click.echo(f'{total + count} posts...', err=True)
+
+    try:
+        for path in paths:
+            f, path_format = open_input(path, format)
+
+            with f:
+                total += import_posts(
+                    read_records(f, path_format), batch_size, progress
+                )
+    finally:
+        if statements:
+            click.echo('Rebuilding indexes...', err=True)
+            restore_post_indexes(db, statements)
+
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f'Imported {total} posts in {elapsed:.1f}s'
+        f' ({total / elapsed if elapsed else 0:.0f} rows/s).'
+    )
+
+
+def iter_posts(since=None, until=None, chunk_size=None):
+    """Yield posts joined with their author, oldest first.
+    The posts are read in chunks of ``chunk_size`` rows, each fetched
+    by its own query that continues from the last ``(created, id)`` of
+    the previous one. No statement stays open while the rows are
+    yielded, so a long export doesn't hold SQLite's shared lock and
+    block writers, whatever the journal mode.
+    :param since: only posts created at or after this datetime
+    :param until: only posts created before this datetime
+    :param chunk_size: rows per query, defaults to the
+        ``EXPORT_CHUNK_SIZE`` config
+    Times with an offset are converted to UTC, like imported ones.
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+
+    if since is not None:
+        since = to_utc(since).isoformat(' ')
+
+    if until is not None:
+        until = to_utc(until).isoformat(' ')
+
+    if since is not None and until is not None:
+        name, params = 'post.export_range', (since, until)
+    elif since is not None:
+        name, params = 'post.export_since', (since,)
+    elif until is not None:
+        name, params = 'post.export_until', (until,)
+    else:
+        name, params = 'post.export', ()
+
+    db = get_read_db()
+
+    while True:
+        rows = run(db, name, (*params, chunk_size)).fetchall()
+        yield from rows
+
+        if len(rows) < chunk_size:
+            break
+
+        # compared as text, the way the index cursors are
+        last = (str(rows[-1]['created']), rows[-1]['id'])
+
+        if until is not None:
+            name = 'post.export_after_until'
+            params = (*last, until)
+        else:
+            name = 'post.export_after'
+            params = last
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(dict(row), default=str) + '\n'
+
+
+def iter_gzip(chunks):
+    """Compress text chunks into a gzip stream as they are produced."""
+    compressor = zlib.compressobj(wbits=31)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf8'))
+
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def parse_date(value):
+    if not value:
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f'Invalid date {value!r}.')
+
+
+@bp.route('/export.jsonl')
+@login_required
+def export():
+    """Stream all posts as JSON lines, optionally gzipped."""
+    chunks = iter_jsonl(
+        iter_posts(
+            since=parse_date(request.args.get('since')),
+            until=parse_date(request.args.get('until')),
+        )
+    )
+
+    if request.args.get('gzip'):
+        return Response(
+            stream_with_context(iter_gzip(chunks)),
+            mimetype='application/gzip',
+            headers={'Content-Disposition': 'attachment; filename=posts.jsonl.gz'},
+        )
+
+    return Response(stream_with_context(chunks), mimetype='application/x-ndjson')
+
+
+def iter_changes(since=0, limit=None):
+    """Yield the latest change of every post changed after ``since``.
+    Each change has the ``seq`` to resume from, the post ``id``, an
+    ``op`` of ``'upsert'`` or ``'delete'``, and for upserts the current
+    ``post``.
+    :param since: ``seq`` of the last change already seen
+    :param limit: stop after this many changes
+    """
+    params = (since, -1 if limit is None else limit)
+
+    for row in run(get_read_db(), 'post.changes', params):
+        change = {
+            'seq': row['seq'],
+            'id': row['post_id'],
+            'op': 'delete' if row['deleted'] else 'upsert',
+            'changed': row['changed'],
+            'post': None,
+        }
+
+        if not row['deleted']:
+            change['post'] = {
+                'id': row['post_id'],
+                'title': row['title'],
+                'body': row['body'],
+                'created': row['created'],
+                'updated': row['updated'],
+                'author_id': row['author_id'],
+                'username': row['username'],
+            }
+
+        yield change
+
+
+def parse_seq(value):
+    try:
+        seq = int(value or 0)
+    except ValueError:
+        seq = None
+
+    if seq is None or not fits_integer(seq):
+        abort(400, f'Invalid change cursor {value!r}.')
+
+    return seq
+
+
+@bp.route('/changes')
+@login_required
+def changes():
+    """Return the posts changed since the ``since`` cursor as JSON."""
+    since = parse_seq(request.args.get('since'))
+    limit = current_app.config['CHANGES_PAGE_SIZE']
+    page = list(iter_changes(since, limit + 1))
+    more = len(page) > limit
+    page = page[:limit]
+    return current_app.response_class(
+        json.dumps({
+            'changes': page,
+            'next': page[-1]['seq'] if page else since,
+            'more': more,
+        }, default=str),
+        mimetype='application/json',
+    )
+
+
+@click.command('changes')
+@click.option('--since', default=0, show_default=True,
+              help='Sequence number of the last change already seen.')
+@click.option('--limit', type=int, help='Stop after this many changes.')
+@with_appcontext
+def changes_command(since, limit):
+    """Print posts changed since a cursor as JSON lines."""
+    last = since
+
+    for change in iter_changes(since, limit):
+        click.echo(json.dumps(change, default=str))
+        last = change['seq']
+
+    click.echo(f'next: {last}', err=True)
+
+
+@click.command('export-posts')
+@click.option('-o', '--output', default='-', type=click.Path(allow_dash=True),
+              help='File to write to, standard output by default.')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--since', type=click.DateTime(),
+              help='Only posts created at or after this time.')
+@click.option('--until', type=click.DateTime(),
+              help='Only posts created before this time.')
+@with_appcontext
+def export_posts_command(output, compress, since, until):
+    """Export posts as JSON lines."""
+    chunks = iter_jsonl(iter_posts(since, until))
+
+    if compress:
+        with click.open_file(output, 'wb') as f:
+            for data in iter_gzip(chunks):
+                f.write(data)
+    else:
+        with click.open_file(output, 'w', encoding='utf8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+
+def init_app(app):
+    app.cli.add_command(import_posts_command)
+    app.cli.add_command(export_posts_command)
+    app.cli.add_command(changes_command)
+    app.register_blueprint(bp)
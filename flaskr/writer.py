@@ -0,0 +1,248 @@
+'''
+A single writer thread with group commit
+
+SQLite allows one writer at a time, and every commit waits for the
+journal to reach the disk. When every request commits its own
+transaction, a burst of posts means one sync per request, and the
+requests queue up on the write lock or fail with "database is locked".
+
+With WRITE_QUEUE enabled, one WriteQueue thread per app owns the write
+connection and request handlers hand their writes to it as jobs. The
+thread waits up to WRITE_QUEUE_WINDOW_MS after the first job for more to
+arrive, up to WRITE_QUEUE_MAX_BATCH of them, runs them all in one
+transaction and commits once, so the whole batch costs a single sync.
+Each job runs inside its own SAVEPOINT, so a job that fails, for
+example on a UNIQUE constraint, is rolled back and gets its exception
+without affecting the other jobs in the batch.
+
+A job is a function taking the connection and returning a result:
+
+    def insert_post(db, title, body, author_id):
+        return db.execute('INSERT INTO post ...', (...)).lastrowid
+
+run_write(insert_post, title, body, author_id) submits it and waits for
+its result, re-raising the job's exception in the request. A job must
+not commit or roll back itself. When WRITE_QUEUE is disabled, run_write
+runs the job on the request's get_write_db connection and commits right
+away, so views are written the same way either way. A job still
+waiting in the queue after WRITE_QUEUE_TIMEOUT seconds is cancelled and
+the request fails with concurrent.futures.TimeoutError; a job that had
+already started by then may still be committed. execute() wraps a
+single statement from flaskr.queries as a job.
+
+'''
+
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+from flaskr import queries
+from flaskr.db import connect, get_write_db
+from flaskr.timing import add_time
+
+_stop = object()
+
+
+class WriteQueue(object):
+    def __init__(self, connect, window=0.002, max_batch=100):
+        # imported here, most apps never start a writer thread
+        import queue
+
+        self._connect = connect
+        self.window = window
+        self.max_batch = max_batch
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.jobs = 0
+
+    def submit(self, func, *args):
+        """Queue a job and return a future for its result."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='flaskr-writer', daemon=True
+                )
+                self._thread.start()
+
+        from concurrent.futures import Future
+
+        future = Future()
+        self._jobs.put((future, func, args))
+        return future
+
+    def close(self):
+        """Finish the queued jobs and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._jobs.put(_stop)
+            thread.join()
+
+    def _run(self):
+        from queue import Empty
+
+        db = None
+
+        try:
+            while True:
+                batch = [self._jobs.get()]
+
+                if batch[0] is _stop:
+                    return
+
+                deadline = time.monotonic() + self.window
+
+                while len(batch) < self.max_batch:
+                    try:
+                        job = self._jobs.get(
+                            timeout=max(0, deadline - time.monotonic())
+                        )
+                    except Empty:
+                        break
+
+                    batch.append(job)
+
+                    if job is _stop:
+                        break
+
+                stop = batch[-1] is _stop
+
+                if stop:
+                    batch.pop()
+
+                db = self._commit(db, batch)
+
+                if stop:
+                    return
+        finally:
+            if db is not None:
+                db.close()
+
+    def _commit(self, db, batch):
+        """Run a batch in one transaction and resolve its futures. Any
+        error outside of a job fails the whole batch instead of the
+        thread, and the connection is opened again for the next batch.
+        :return: the connection to use for the next batch
+        """
+        batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+
+        if not batch:
+            return db
+
+        results = []
+
+        try:
+            if db is None:
+                # autocommit mode, the transactions are managed explicitly
+                db = self._connect()
+
+            db.execute('BEGIN IMMEDIATE')
+
+            for future, func, args in batch:
+                db.execute('SAVEPOINT job')
+
+                try:
+                    result = func(db, *args)
+                except Exception as e:
+                    db.execute('ROLLBACK TO job')
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+
+                db.execute('RELEASE job')
+
+            db.execute('COMMIT')
+        except Exception as e:
+            results = [(future, None, e) for future, _, _ in batch]
+
+            if db is not None:
+                try:
+                    db.rollback()
+                except sqlite3.Error:
+                    # a broken connection, start over with a new one
+                    db.close()
+                    db = None
+
+        with self._lock:
+            self.batches += 1
+            self.jobs += len(results)
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+        return db
+
+
+def get_write_queue(app):
+    """Get the write queue of an app, starting it if needed."""
+    writes = app.extensions.get('flaskr.write_queue')
+
+    if writes is None:
+        writes = app.extensions.setdefault('flaskr.write_queue', WriteQueue(
+            lambda: connect(
+                app.config, check_same_thread=False, isolation_level=None
+            ),
+            window=app.config['WRITE_QUEUE_WINDOW_MS'] / 1000,
+            max_batch=app.config['WRITE_QUEUE_MAX_BATCH'],
+        ))
+
+    return writes
+
+
+def run_write(func, *args):
+    """Run a write job and return its result.
+    :param func: called with the write connection and ``args``
+    :raise: whatever the job raised, after its changes were rolled back
+    """
+    app = current_app._get_current_object()
+
+    if app.config['WRITE_QUEUE']:
+        # only an alias of the builtin TimeoutError from Python 3.11
+        from concurrent.futures import TimeoutError
+
+        start = time.perf_counter()
+        future = get_write_queue(app).submit(func, *args)
+
+        try:
+            return future.result(timeout=app.config['WRITE_QUEUE_TIMEOUT'])
+        except TimeoutError:
+            # a job that hasn't started won't run, one that has may
+            # still be committed
+            future.cancel()
+            raise
+        finally:
+            # the writer thread's statements aren't in the request's
+            # query log, count the wait for them instead
+            add_time('db', time.perf_counter() - start)
+
+    db = get_write_db()
+
+    try:
+        result = func(db, *args)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+    return result
+
+
+def _execute(db, name, parameters, stats):
+    return queries.run(db, name, parameters, stats).lastrowid
+
+
+def execute(name, parameters=()):
+    """Run one registered write statement with :func:`run_write`.
+    :param name: key of the statement in :data:`flaskr.queries.QUERIES`
+    :return: the rowid of the last inserted row
+    """
+    # the writer thread has no app context to find the stats in
+    return run_write(_execute, name, parameters, queries.get_stats())
@@ -21,6 +21,11 @@ without running the server.
 The runner fixture is similar to client. app.test_cli_runner() creates a runner 
 that can call the Click commands registered with the application.
 
+Some settings, such as METRICS or SERVER_TIMING, only take effect when the 
+application is created. The make_app fixture returns a function that creates 
+another test application with extra config, using the database of the app 
+fixture, so those tests don't have to repeat the test config.
+
 Pytest uses fixtures by matching their function names with the names of arguments 
 in the test functions. For example, the test_hello function you’ll write next takes 
 a client argument. Pytest matches that with the client fixture function, calls it, 
@@ -71,6 +76,18 @@ def app():
     os.unlink(db_path)
 
 
+@pytest.fixture
+def make_app(app):
+    def make_app(**config):
+        return create_app({
+            'TESTING': True,
+            'DATABASE': app.config['DATABASE'],
+            **config,
+        })
+
+    return make_app
+
+
 @pytest.fixture
 def client(app):
     return app.test_client()
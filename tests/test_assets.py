@@ -0,0 +1,85 @@
+'''
+
+flask build-assets should write a minified, fingerprinted and gzipped
+copy of every static file with a manifest. Once it has run, url_for
+should link to the copies, which are served precompressed and cached
+for good.
+
+'''
+
+import gzip
+import json
+import os
+
+import pytest
+from flask import url_for
+from flaskr.assets import minify_css
+
+
+@pytest.fixture
+def built_app(make_app, tmp_path):
+    built_app = make_app(ASSETS_DIR=str(tmp_path))
+    result = built_app.test_cli_runner().invoke(args=['build-assets'])
+    assert 'Built 1 assets.' in result.output
+    return built_app
+
+
+def test_minify_css():
+    css = '/* comment */\na  {\n  content: "a ;  b" ;\n  color: red;\n}\n'
+    assert minify_css(css) == 'a{content: "a ;  b";color: red}'
+
+
+def test_no_manifest(app):
+    with app.test_request_context():
+        assert url_for('static', filename='style.css') == '/static/style.css'
+
+
+def test_build(built_app, tmp_path):
+    with open(tmp_path / 'manifest.json') as f:
+        manifest = json.load(f)
+
+    hashed = manifest['style.css']
+    assert hashed.startswith('style.') and hashed.endswith('.css')
+    assert os.path.exists(tmp_path / hashed)
+    assert os.path.exists(tmp_path / (hashed + '.gz'))
+
+    with built_app.test_request_context():
+        assert url_for('static', filename='style.css') == f'/static/dist/{hashed}'
+
+    assert f'/static/dist/{hashed}' in built_app.test_client().get('/') \
+        .get_data(as_text=True)
+
+
+def test_serve(built_app):
+    client = built_app.test_client()
+
+    with built_app.test_request_context():
+        url = url_for('static', filename='style.css')
+
+    response = client.get(url)
+    assert response.mimetype == 'text/css'
+    assert 'Content-Encoding' not in response.headers
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    css = response.data
+    response.close()
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == css
+    response.close()
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in response.headers
+    response.close()
+
+
+def test_serve_only_assets(built_app):
+    client = built_app.test_client()
+    assert client.get('/static/dist/manifest.json').status_code == 404
+    assert client.get('/static/dist/../../flaskr.sqlite').status_code == 404
+    assert client.get('/static/dist/missing.css').status_code == 404
+    # the plain name still works for clients with an old page
+    response = client.get('/static/style.css')
+    assert response.status_code == 200
+    response.close()
@@ -35,9 +35,15 @@ logging out.
 
 '''
 
+import time
+
 import pytest
 from flask import g, session
+from flaskr.auth import get_user_cache, invalidate_user
 from flaskr.db import get_db
+from flaskr.hashing import PasswordHasher, get_hasher, hash_prefix
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash
 
 
 def test_register(client, app):
@@ -91,4 +97,107 @@ def test_logout(client, auth):
 
     with client:
         auth.logout()
-        assert 'user_id' not in session
\ No newline at end of file
+        assert 'user_id' not in session
+
+def test_user_loaded_lazily(client, auth):
+    auth.login()
+
+    with client:
+        client.get('/hello')
+        assert 'user' not in g
+
+    with client:
+        client.get('/create')
+        assert 'user' in g
+        assert g.user['username'] == 'test'
+
+
+def test_user_cache(client, auth, app):
+    auth.login()
+    assert b'<span>test</span>' in client.get('/create').data
+
+    with app.test_request_context():
+        # the password hash is not cached
+        assert get_user_cache().get(1) == {'id': 1, 'username': 'test'}
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+
+    assert b'<span>test</span>' in client.get('/create').data
+
+    with app.test_request_context():
+        invalidate_user(1)
+
+    assert b'<span>renamed</span>' in client.get('/create').data
+
+
+def test_login_rehashes_password(client, auth, app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    auth.login()
+
+    with app.app_context():
+        pwhash = get_db().execute(
+            'SELECT password FROM user WHERE id = 1'
+        ).fetchone()[0]
+
+    assert pwhash.startswith('pbkdf2:sha256:1000$')
+    auth.logout()
+    assert auth.login().headers['Location'] == 'http://localhost/'
+
+    stats = get_hasher(app).stats()
+    assert stats['pending'] == 0
+    assert stats['timings']['check']['count'] == 2
+    assert stats['timings']['generate']['count'] == 1
+
+
+def test_hash_in_worker_process():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+
+    try:
+        pwhash = hasher.generate('secret')
+        assert hasher.check(pwhash, 'secret')
+        assert not hasher.check(pwhash, 'wrong')
+        assert not hasher.needs_rehash(pwhash)
+    finally:
+        hasher.shutdown()
+
+
+def test_hash_worker_killed():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+
+    try:
+        hasher.generate('secret')
+
+        for process in list(hasher._executor._processes.values()):
+            process.kill()
+            process.join()
+
+        # the broken pool is replaced instead of failing every later hash
+        for n in range(3):
+            assert hasher.check(hasher.generate('secret'), 'secret')
+    finally:
+        hasher.shutdown()
+
+
+def test_hash_timeout():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, timeout=0.1)
+
+    try:
+        # a worker that doesn't answer in time fails the request instead
+        # of blocking it, and gives its slot back
+        with pytest.raises(ServiceUnavailable):
+            hasher._run('check', time.sleep, 1)
+
+        assert hasher.stats()['pending'] == 0
+    finally:
+        hasher.shutdown()
+
+
+@pytest.mark.parametrize('method', (
+    'pbkdf2:sha256', 'pbkdf2:sha256:1000', 'pbkdf2:sha512:2000', 'sha256',
+))
+def test_hash_prefix_matches_werkzeug(method):
+    pwhash = generate_password_hash('secret', method)
+    assert pwhash.split('$', 1)[0] == hash_prefix(method)
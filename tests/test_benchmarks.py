@@ -0,0 +1,41 @@
+'''
+
+The benchmark script should run every scenario against a tiny database
+and write its results as JSON, and refuse too few posts for the delete
+scenario.
+
+'''
+
+import importlib.util
+import json
+import os
+
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    'benchmarks_run',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'benchmarks', 'run.py'),
+)
+bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench)
+
+
+def test_run(tmp_path):
+    output = tmp_path / 'results.json'
+    args = ['--posts', '3', '--requests', '2', '--hash-method', 'pbkdf2:sha256:1']
+    assert bench.main([*args, '-o', str(output)]) == 0
+
+    report = json.loads(output.read_text())
+    assert set(report['results']) == set(bench.SCENARIOS)
+    assert report['results']['delete']['requests'] == 2
+    assert report['results']['index']['queries']
+
+    # a run compared against itself has no regressions
+    assert bench.main([*args, '--scenario', 'index',
+                       '--compare', str(output), '--tolerance', '100']) == 0
+
+
+@pytest.mark.parametrize('args', (['--posts', '1'], ['--requests', '0']))
+def test_too_small(args):
+    with pytest.raises(SystemExit):
+        bench.main(args)
@@ -25,8 +25,16 @@ exist in the database.
 
 '''
 
+from base64 import urlsafe_b64encode
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
 import pytest
 
+from flaskr.blog import encode_cursor
+from flaskr.blog import get_page_cache
+from flaskr.blog import get_post_version
 from flaskr.db import get_db
 
 
@@ -107,4 +115,324 @@ def test_delete(client, auth, app):
     with app.app_context():
         db = get_db()
         post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
-        assert post is None  
\ No newline at end of file
+        assert post is None  
+
+@pytest.mark.parametrize("stream", (False, True))
+def test_index_pagination(client, app, stream):
+    app.config.update(POSTS_PER_PAGE=2, STREAM_INDEX=stream, PAGE_CACHE_TYPE=None)
+
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id, created) VALUES (?, '', 1, ?)",
+            [(f"post {n}", f"2018-01-0{n} 00:00:00") for n in range(2, 6)],
+        )
+        db.commit()
+
+    response = client.get("/")
+    assert b"post 5" in response.data
+    assert b"post 4" in response.data
+    assert b"post 3" not in response.data
+    assert b"Newer" not in response.data
+    older = response.data.split(b'href="')[-1].split(b'"')[0].decode()
+    assert "after=" in older
+
+    response = client.get(older)
+    assert b"post 3" in response.data
+    assert b"post 2" in response.data
+    assert b"post 5" not in response.data
+    assert b"Newer" in response.data
+    older = response.data.split(b'href="')[-1].split(b'"')[0].decode()
+
+    response = client.get(older)
+    assert b"test title" in response.data
+    assert b"Older" not in response.data
+    newer = response.data.split(b'href="')[-1].split(b'"')[0].decode()
+    assert "before=" in newer
+
+    response = client.get(newer)
+    assert b"post 3" in response.data
+    assert b"post 2" in response.data
+    assert b"test title" not in response.data
+    assert b"Older" in response.data
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    ("%%%", encode_cursor({"created": "2018-01-01 00:00:00", "id": 2**80})),
+)
+def test_index_invalid_cursor(client, cursor):
+    assert client.get("/", query_string={"after": cursor}).status_code == 400
+
+
+@pytest.mark.parametrize("cache_type", ("lru", "file"))
+def test_index_cache(client, auth, app, tmp_path, cache_type):
+    app.config["PAGE_CACHE_TYPE"] = cache_type
+    app.config["PAGE_CACHE_DIR"] = str(tmp_path)
+    assert b"test title" in client.get("/").data
+
+    # writes by other workers bump the post version in the cache key
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+
+    assert b"changed" in client.get("/").data
+
+    # logged in viewers get their own page with edit links
+    auth.login()
+    assert b'href="/1/update"' in client.get("/").data
+
+    client.post("/create", data={"title": "created", "body": ""})
+    response = client.get("/")
+    assert b"changed" in response.data
+    assert b"created" in response.data
+
+    auth.logout()
+    assert b"created" in client.get("/").data
+    assert b'href="/1/update"' not in client.get("/").data
+
+
+def test_index_cache_keyed_on_build(make_app, tmp_path):
+    def make_build(build_id):
+        return make_app(
+            PAGE_CACHE_TYPE="file", PAGE_CACHE_DIR=str(tmp_path), BUILD_ID=build_id
+        )
+
+    old = make_build("old")
+
+    with old.test_request_context("/"):
+        version = get_post_version()["version"]
+        get_page_cache().set(("old", version, None, None, None), "old page")
+
+    assert old.test_client().get("/").data == b"old page"
+    # the file cache outlives the deploy, its pages don't
+    assert b"test title" in make_build("new").test_client().get("/").data
+
+
+def test_search(client, app):
+    app.config["POSTS_PER_PAGE"] = 1
+
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO post (title, body, author_id) VALUES"
+            " ('second', 'another <b>test</b> body', 1)"
+        )
+        db.commit()
+
+    assert client.get("/search").status_code == 200
+    response = client.get("/search?q=body")
+    assert b"<mark>body</mark>" in response.data
+    assert b"More results" in response.data
+    more = response.data.split(b'href="')[-1].split(b'"')[0].decode()
+
+    response = client.get(more.replace("&amp;", "&"))
+    assert b"<mark>body</mark>" in response.data
+    assert b"More results" not in response.data
+
+    # markup in posts is escaped and FTS5 syntax is searched literally
+    response = client.get("/search?q=another")
+    assert b"&lt;b&gt;test&lt;/b&gt;" in response.data
+    assert b"No posts match" in client.get('/search?q="NEAR(' ).data
+
+    # control characters separate words instead of reaching FTS5
+    assert b"<mark>another</mark>" in client.get("/search?q=another%00").data
+    assert b"No posts match" in client.get("/search?q=x%00y").data
+    assert b"No posts match" in client.get("/search?q=%00%01").data
+
+
+@pytest.mark.parametrize("cursor", ("1.0|x", "nan|1", "inf|1", f"1.0|{2**80}"))
+def test_search_invalid_cursor(client, cursor):
+    after = urlsafe_b64encode(cursor.encode()).decode()
+    response = client.get("/search", query_string={"q": "test", "after": after})
+    assert response.status_code == 400
+
+
+def test_search_follows_writes(client, auth):
+    auth.login()
+    client.post("/1/update", data={"title": "renamed", "body": "fresh"})
+    assert b"No posts match" in client.get("/search?q=test").data
+    assert b"renamed" in client.get("/search?q=fresh").data
+
+    client.post("/1/delete")
+    assert b"No posts match" in client.get("/search?q=fresh").data
+
+
+def test_index_streamed(client, auth, app):
+    app.config["STREAM_INDEX"] = True
+    response = client.get("/")
+    assert response.is_streamed
+    assert b"test title" in response.data
+
+    auth.login()
+    assert b'href="/1/update"' in client.get("/").data
+
+    # flashed messages are shown once, even though the session cookie
+    # goes out before the page is rendered
+    with client.session_transaction() as session:
+        session["_flashes"] = [("message", "flashed")]
+
+    assert b"flashed" in client.get("/").data
+    assert b"flashed" not in client.get("/").data
+
+
+@pytest.mark.parametrize("profile", ("default", "read-heavy"))
+def test_index_streamed_during_write(make_app, profile):
+    app = make_app(
+        STREAM_INDEX=True,
+        PAGE_CACHE_TYPE=None,
+        POSTS_PER_PAGE=200,
+        DB_PRAGMA_PROFILE=profile,
+        DB_PRAGMAS={"busy_timeout": 100},
+    )
+
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id) VALUES (?, '', 1)",
+            [(f"post {n}",) for n in range(200)],
+        )
+        db.commit()
+
+    reader = app.test_client()
+    writer = app.test_client()
+    writer.post("/auth/login", data={"username": "test", "password": "test"})
+    page = reader.get("/", buffered=False)
+    chunks = page.iter_encoded()
+    next(chunks)
+
+    # the reader hasn't read the rest of the page, the write still goes
+    # through without waiting for it
+    response = writer.post("/create", data={"title": "created", "body": ""})
+    assert response.status_code == 302
+
+    assert b"post 0" in b"".join(chunks)
+    page.close()
+
+
+def test_index_conditional_get(client, auth, app):
+    app.config["SQL_INSTRUMENT"] = True
+    response = client.get("/")
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    # only the version lookup ran
+    assert response.headers["X-SQL-Queries"] == "1"
+
+    response = client.get("/", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    # other viewers and other pages have their own validators
+    response = client.get("/?after=x", headers={"If-None-Match": etag})
+    assert response.status_code == 400
+    auth.login()
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 200
+
+    # a time doesn't identify the viewer, so it isn't sent or honoured
+    response = client.get("/", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 200
+    assert "Last-Modified" not in response.headers
+
+    # any write changes the validator
+    auth.logout()
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_conditional_get_after_deploy(client, make_app):
+    response = client.get("/")
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    deployed = make_app(BUILD_ID="new").test_client()
+    assert deployed.get("/", headers={"If-None-Match": etag}).status_code == 200
+
+    # templates changed after the last write
+    deployed = make_app()
+    deployed.extensions["flaskr.build_time"] = datetime.now(timezone.utc).replace(
+        microsecond=0
+    ) + timedelta(hours=1)
+    response = deployed.test_client().get(
+        "/", headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 200
+    assert response.headers["Last-Modified"] != last_modified
+
+
+def test_detail(client, auth, app):
+    response = client.get("/1")
+    assert b"test title" in response.data
+    assert b"by test on 2018-01-01" in response.data
+    assert b'href="/1/update"' not in response.data
+    assert b'href="/1"' in client.get("/").data
+    assert client.get("/2").status_code == 404
+    assert client.get("/99999999999999999999").status_code == 404
+
+    auth.login()
+    assert b'href="/1/update"' in client.get("/1").data
+    assert client.get("/99999999999999999999/update").status_code == 404
+
+
+def test_detail_hot_post_cache(client, auth, app):
+    app.config["SQL_INSTRUMENT"] = True
+    client.get("/1")
+    # only the version lookup for the conditional GET, the post is cached
+    assert client.get("/1").headers["X-SQL-Queries"] == "1"
+
+    # a write to another post only costs a lookup of the post's change
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('x', '', 1)")
+        db.commit()
+
+    response = client.get("/1")
+    assert b"test title" in response.data
+    assert response.headers["X-SQL-Queries"] == "2"
+    assert client.get("/1").headers["X-SQL-Queries"] == "1"
+
+    auth.login()
+    client.post("/1/update", data={"title": "updated", "body": ""})
+    assert b"updated" in client.get("/1").data
+
+    # a write by another worker is seen through the post version
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+
+    assert b"changed" in client.get("/1").data
+
+    client.post("/1/delete")
+    assert client.get("/1").status_code == 404
+
+
+def test_update_sets_updated(client, auth, app):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET updated = created")
+        db.commit()
+        version = db.execute("SELECT version FROM post_version").fetchone()[0]
+        seq = db.execute("SELECT MAX(seq) FROM post_change").fetchone()[0]
+
+    auth.login()
+    client.post("/1/update", data={"title": "updated", "body": ""})
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
+        assert post["updated"] > post["created"]
+        # one edit is one change
+        assert db.execute(
+            "SELECT version FROM post_version"
+        ).fetchone()[0] == version + 1
+        assert db.execute(
+            "SELECT MAX(seq) FROM post_change"
+        ).fetchone()[0] == seq + 1
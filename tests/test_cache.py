@@ -0,0 +1,89 @@
+'''
+
+The caches are exercised through the blog index tests. These tests check 
+the parts that are hard to reach from a view: eviction of the least 
+recently used entry, expiry after the ttl and the hit and miss counters.
+
+'''
+
+import os
+
+import pytest
+
+from flaskr.cache import FileCache, LRUCache, make_cache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+@pytest.mark.parametrize('factory', (
+    lambda tmp_path: LRUCache(ttl=-1),
+    lambda tmp_path: FileCache(str(tmp_path), ttl=-1),
+))
+def test_ttl_expires(tmp_path, factory):
+    cache = factory(tmp_path)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_file_cache_shared(tmp_path):
+    FileCache(str(tmp_path)).set(('a', 1), 'value')
+    cache = FileCache(str(tmp_path))
+    assert cache.get(('a', 1)) == 'value'
+    cache.clear()
+    assert cache.get(('a', 1)) is None
+
+
+def test_make_cache(tmp_path):
+    assert make_cache(None) is None
+    assert isinstance(make_cache('lru'), LRUCache)
+    assert isinstance(make_cache('file', directory=str(tmp_path)), FileCache)
+
+    with pytest.raises(ValueError):
+        make_cache('memcached')
+
+
+def test_file_cache_max_size(tmp_path):
+    cache = FileCache(str(tmp_path), max_size=2)
+
+    for n, key in enumerate('abc'):
+        cache.set(key, n)
+        # the mtime decides which file is the oldest
+        os.utime(cache._path(key), (n, n))
+
+    assert len(cache) == 2
+    assert cache.get('a') is None
+    assert cache.get('c') == 2
+
+
+def test_file_cache_prunes_past_max_size(tmp_path, monkeypatch):
+    cache = FileCache(str(tmp_path), max_size=3)
+    cache.set('a', 0)
+    scans = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', counting_scandir)
+
+    # the directory is only listed once the files counted go past max_size
+    for key in 'abc':
+        cache.set(key, 1)
+
+    assert scans == []
+    cache.set('d', 1)
+    assert len(scans) == 1
+    assert len(cache) == 3
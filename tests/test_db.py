@@ -10,10 +10,14 @@ is used to call the init-db command by name.
 
 '''
 
+import os
 import sqlite3
+import threading
 
 import pytest
-from flaskr.db import get_db
+from flaskr import create_app
+from flaskr.db import get_db, get_pool, get_read_db, get_write_db, init_db
+from flaskr.pool import ConnectionPool
 
 
 def test_get_close_db(app):
@@ -36,4 +40,137 @@ def test_init_db_command(runner, monkeypatch):
     monkeypatch.setattr('flaskr.db.init_db', fake_init_db)
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
-    assert Recorder.called
\ No newline at end of file
+    assert Recorder.called
+
+def test_init_db_makes_database_dir(tmp_path):
+    database = tmp_path / 'data' / 'flaskr.sqlite'
+    app = create_app({'TESTING': True, 'DATABASE': str(database)})
+
+    with app.app_context():
+        init_db()
+
+    assert database.exists()
+    # not the instance folder, which the database isn't in
+    assert not os.path.exists(app.instance_path)
+
+
+def test_pooled_connection_reused(app):
+    app.config['DB_POOL_SIZE'] = 1
+
+    with app.app_context():
+        db = get_db()
+
+    with app.app_context():
+        assert get_db() is db
+        assert get_db().execute('SELECT 1').fetchone()[0] == 1
+
+    stats = get_pool(app).stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+    assert stats['idle'] == 1
+
+
+def test_pool_bounded_and_health_checked():
+    opened = []
+
+    def connect():
+        opened.append(sqlite3.connect(':memory:', check_same_thread=False))
+        return opened[-1]
+
+    pool = ConnectionPool(connect, max_size=1)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats()['idle'] == 1
+
+    # the extra connection was closed instead of pooled
+    with pytest.raises(sqlite3.ProgrammingError):
+        second.execute('SELECT 1')
+
+    # a broken idle connection is replaced on checkout
+    first.close()
+    third = pool.acquire()
+    assert third is not first
+    assert pool.stats()['discarded'] == 1
+
+
+def test_pool_health_check_reads_file(tmp_path):
+    path = tmp_path / 'pool.sqlite'
+    pool = ConnectionPool(
+        lambda: sqlite3.connect(str(path), check_same_thread=False)
+    )
+    first = pool.acquire()
+    first.execute('CREATE TABLE t (x)')
+    pool.release(first)
+
+    path.write_bytes(b'not a database' * 512)
+    assert pool.acquire() is not first
+    assert pool.stats()['discarded'] == 1
+
+
+def test_pragma_profile(app):
+    app.config['DB_PRAGMA_PROFILE'] = 'read-heavy'
+    app.config['DB_PRAGMAS'] = {'cache_size': -1000}
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+        assert db.execute('PRAGMA cache_size').fetchone()[0] == -1000
+
+
+@pytest.mark.parametrize(('profile', 'pragmas', 'message'), (
+    ('fast', {}, 'Unknown DB_PRAGMA_PROFILE'),
+    ('default', {'user_version': 1}, 'Unsupported PRAGMA'),
+    ('default', {'synchronous': 'off; DROP TABLE post'}, 'Invalid value'),
+))
+def test_pragma_profile_validate(app, profile, pragmas, message):
+    app.config['DB_PRAGMA_PROFILE'] = profile
+    app.config['DB_PRAGMAS'] = pragmas
+
+    with app.app_context():
+        with pytest.raises(ValueError) as e:
+            get_db()
+
+    assert message in str(e.value)
+
+
+def test_read_db_is_read_only(app):
+    app.config['DB_POOL_SIZE'] = 1
+
+    with app.app_context():
+        db = get_read_db()
+        assert db is get_read_db()
+        assert db is not get_db()
+        assert db.execute('PRAGMA query_only').fetchone()[0] == 1
+        assert db.execute('PRAGMA cache_size').fetchone()[0] == -32000
+
+        with pytest.raises(sqlite3.OperationalError) as e:
+            db.execute("UPDATE user SET username = 'x'")
+
+        assert 'readonly' in str(e.value)
+
+    # read and write connections are pooled separately
+    assert get_pool(app, read_only=True).stats()['idle'] == 1
+    assert get_pool(app).stats()['idle'] == 1
+
+
+def test_write_db_serialized(app):
+    acquired = []
+
+    def try_lock():
+        lock = app.extensions['flaskr.db_write_lock']
+        acquired.append(lock.acquire(blocking=False))
+
+    with app.app_context():
+        assert get_write_db() is get_db()
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+
+    thread = threading.Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    assert acquired == [False, True]
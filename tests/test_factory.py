@@ -8,6 +8,13 @@ The only behavior that can change is passing test config. If config is not passe
 there should be some default configuration, otherwise the configuration should be 
 overridden.
 
+Creating the app is also what every worker of a pre-fork server does
+before it can take requests. A fresh interpreter should be able to
+import flaskr and create the app within a time budget, without
+importing the modules that only some requests need. That is checked
+both for a testing app and for a production one, which also compiles
+and loads every template.
+
 
 
 
@@ -15,7 +22,32 @@ overridden.
 
 
 
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from flaskr import create_app
+
+# modules create_app() must not import, they are only needed by some
+# requests or commands
+HEAVY_MODULES = (
+    'concurrent.futures', 'cProfile', 'csv', 'gzip', 'multiprocessing',
+    'pstats', 'queue',
+)
+
+COLD_START = f'''
+import json, sys, time
+start = time.perf_counter()
 from flaskr import create_app
+app = create_app(json.loads(sys.argv[1]))
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'startup': app.extensions['flaskr.startup'],
+    'heavy': [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+}}))
+'''
 
 
 def test_config():
@@ -25,4 +57,44 @@ def test_config():
 
 def test_hello(client):
     response = client.get('/hello')
-    assert response.data == b'Hello, World!'
\ No newline at end of file
+    assert response.data == b'Hello, World!'
+
+
+def test_startup_phases(app):
+    phases = dict(app.extensions['flaskr.startup'])
+    assert {'config', 'db', 'auth', 'blog', 'total'} <= set(phases)
+
+
+def test_no_makedirs(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('create_app should not create directories')
+
+    monkeypatch.setattr(os, 'makedirs', fail)
+    create_app({'TESTING': True})
+
+
+@pytest.mark.parametrize('testing', (True, False))
+def test_cold_start(tmp_path, testing):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # a production app warms up the templates, compiling them into an
+    # empty bytecode cache, the slowest start a worker can have
+    (tmp_path / 'jinja_cache').mkdir()
+    config = {'TESTING': testing,
+              'TEMPLATE_CACHE_DIR': str(tmp_path / 'jinja_cache')}
+    output = subprocess.run(
+        [sys.executable, '-c', COLD_START, json.dumps(config)],
+        cwd=root, capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output)
+    phases = dict(result['startup'])
+
+    assert result['heavy'] == []
+    # generous budgets, the whole cold start including importing Flask
+    # usually takes well under 0.5s and create_app() itself a few ms,
+    # plus a few tens of ms to compile the templates
+    assert result['seconds'] < 3
+    assert phases['templates'] < 0.25
+    assert phases['total'] < 0.5
+
+    if not testing:
+        assert os.listdir(tmp_path / 'jinja_cache')
@@ -0,0 +1,53 @@
+'''
+
+With METRICS enabled, requests should be counted and timed per endpoint
+and /metrics should report them, together with the counters of the
+components that have been used, in the Prometheus text format.
+
+'''
+
+import pytest
+from flaskr.metrics import Histogram
+
+
+def test_disabled(client):
+    assert client.get('/metrics').status_code == 404
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1))
+    histogram.observe(('a',), 0.05)
+    histogram.observe(('a',), 0.1)
+    histogram.observe(('a',), 0.5)
+    histogram.observe(('a',), 5)
+    (labels, counts, total), = histogram.collect()
+    assert labels == ('a',)
+    assert counts == [2, 3, 4]
+    assert total == pytest.approx(5.65)
+
+
+def test_metrics(make_app):
+    # the hooks are only installed when the app is created with METRICS
+    client = make_app(METRICS=True, METRICS_BUCKETS=(0.1, 1)).test_client()
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    client.get('/')
+    client.get('/')
+    client.get('/nothing/here')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE flaskr_request_duration_seconds histogram' in text
+    assert ('flaskr_request_duration_seconds_count'
+            '{endpoint="blog.index",method="GET"} 2') in text
+    assert ('flaskr_request_duration_seconds_bucket'
+            '{endpoint="blog.index",method="GET",le="+Inf"} 2') in text
+    assert ('flaskr_requests_total'
+            '{endpoint="auth.login",method="POST",status="302"} 1') in text
+    assert 'flaskr_requests_total{endpoint="none",method="GET",status="404"} 1' in text
+    assert 'flaskr_sql_calls_total{query="user.by_username"} 1' in text
+    assert 'flaskr_password_hash_seconds_count{op="check"} 1' in text
+    assert 'flaskr_cache_hits_total{cache="page"} 1' in text
+    # no pool is configured, so there is nothing to report for it
+    assert 'flaskr_db_pool' not in text
@@ -0,0 +1,112 @@
+'''
+
+Migrations are tested against a database created with the original 
+tutorial schema, like one deployed before migrations existed. Upgrading 
+it should keep its data and end up with the same tables, indexes and 
+triggers as a database created by init-db. A database created by init-db 
+should already count as fully migrated.
+
+'''
+
+import pytest
+
+from flaskr import create_app
+from flaskr.db import get_db
+from flaskr.migrate import load_migrations
+from flaskr.queries import run
+
+
+def schema(db):
+    return {
+        (row['type'], row['name'])
+        for row in db.execute('SELECT type, name FROM sqlite_master')
+        if not row['name'].startswith('sqlite_')
+    }
+
+
+@pytest.fixture
+def old_app(tmp_path):
+    app = create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'old.sqlite')})
+
+    with app.app_context():
+        db = get_db()
+        load_migrations()[0].module.upgrade(db)
+        db.execute("INSERT INTO user (username, password) VALUES ('old', 'x')")
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            " VALUES (?, 'old body', 1, '2017-01-01 00:00:00')",
+            [(f'old {n}',) for n in range(2500)],
+        )
+        db.commit()
+
+    return app
+
+
+def test_upgrade_existing_database(old_app, app):
+    runner = old_app.test_cli_runner()
+    result = runner.invoke(args=['db', 'upgrade'])
+    # the database predates migrations, so even the initial one runs,
+    # finding its tables already there
+    assert f'Applied {len(load_migrations())} migrations.' in result.output
+
+    with old_app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 2500
+        assert db.execute(
+            'SELECT COUNT(*) FROM post WHERE updated = created'
+        ).fetchone()[0] == 2500
+        assert db.execute('SELECT COUNT(*) FROM post_change').fetchone()[0] == 2500
+        assert db.execute(
+            "SELECT COUNT(*) FROM post_fts WHERE post_fts MATCH 'old'"
+        ).fetchone()[0] == 2500
+        upgraded = schema(db)
+
+        # the app's statements set updated, and each write counts as
+        # one change
+        version = db.execute('SELECT version FROM post_version').fetchone()[0]
+        run(db, 'post.insert', ('new', '', 1))
+        assert db.execute(
+            "SELECT updated FROM post WHERE title = 'new'"
+        ).fetchone()[0] is not None
+        assert db.execute(
+            'SELECT version FROM post_version'
+        ).fetchone()[0] == version + 1
+
+    with app.app_context():
+        assert upgraded == schema(get_db())
+
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert 'Applied 0 migrations.' in result.output
+
+
+def test_downgrade(old_app):
+    runner = old_app.test_cli_runner()
+    runner.invoke(args=['db', 'upgrade'])
+
+    result = runner.invoke(args=['db', 'downgrade'])
+    assert 'Reverted 1 migrations.' in result.output
+    result = runner.invoke(args=['db', 'status'])
+    *_, applied, reverted = load_migrations()
+    assert f'[x] {applied.version:04} {applied.name}' in result.output
+    assert f'[ ] {reverted.version:04} {reverted.name}' in result.output
+
+    runner.invoke(args=['db', 'downgrade', '--to', '1'])
+
+    with old_app.app_context():
+        db = get_db()
+        assert schema(db) == {
+            ('table', 'user'), ('table', 'post'), ('table', 'schema_migrations'),
+        }
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 2500
+
+    runner.invoke(args=['db', 'upgrade', '--to', '3'])
+    result = runner.invoke(args=['db', 'status'])
+    assert '[x] 0003 post_fts' in result.output
+    assert '[ ] 0004 post_version' in result.output
+
+
+def test_init_db_is_migrated(runner):
+    result = runner.invoke(args=['db', 'status'])
+    assert '[ ]' not in result.output
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert 'Applied 0 migrations.' in result.output
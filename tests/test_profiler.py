@@ -0,0 +1,91 @@
+'''
+
+With PROFILE enabled, the requests picked by endpoint, header or sample
+rate should leave a profile in PROFILE_DIR, the header only with the
+right secret, and the folder should be pruned to the configured number
+of files.
+
+'''
+
+import os
+import pstats
+
+import pytest
+from flaskr.profiler import prune
+
+
+@pytest.fixture
+def make_client(make_app, tmp_path):
+    def make_client(**config):
+        return make_app(**{
+            'PROFILE': True,
+            'PROFILE_DIR': str(tmp_path),
+            'PROFILE_SAMPLE_RATE': 0,
+            'PROFILE_INTERVAL_MS': 1,
+            **config,
+        }).test_client()
+
+    return make_client
+
+
+def test_sample_endpoint(make_client, tmp_path):
+    client = make_client(PROFILE_ENDPOINTS=('blog.index',))
+    client.get('/hello')
+    client.get('/')
+
+    files = os.listdir(tmp_path)
+    assert len(files) == 1
+    assert '-blog.index-' in files[0]
+    assert files[0].endswith('.folded')
+
+    with open(tmp_path / files[0]) as f:
+        for line in f:
+            stack, count = line.rsplit(' ', 1)
+            assert int(count) > 0
+
+
+def test_cprofile_header(make_client, tmp_path):
+    client = make_client(
+        PROFILE_MODE='cprofile', PROFILE_HEADER='X-Profile',
+        PROFILE_SECRET='secret',
+    )
+    client.get('/')
+    client.get('/', headers={'X-Profile': 'secret'})
+
+    files = os.listdir(tmp_path)
+    assert len(files) == 1
+    assert files[0].endswith('.prof')
+    stats = pstats.Stats(str(tmp_path / files[0]))
+    assert any(name == 'index' for _, _, name in stats.stats)
+
+
+@pytest.mark.parametrize(('secret', 'value'), (
+    (None, ''),
+    (None, '1'),
+    ('secret', ''),
+    ('secret', 'wrong'),
+))
+def test_header_needs_secret(make_client, tmp_path, secret, value):
+    client = make_client(PROFILE_HEADER='X-Profile', PROFILE_SECRET=secret)
+    client.get('/', headers={'X-Profile': value})
+    assert os.listdir(tmp_path) == []
+
+
+def test_sample_rate(make_client, tmp_path):
+    client = make_client(PROFILE_SAMPLE_RATE=1, PROFILE_MAX_FILES=2)
+
+    for _ in range(4):
+        client.get('/hello')
+
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_prune(tmp_path):
+    for n in range(5):
+        path = tmp_path / f'{n}.folded'
+        path.write_text('x' * 10)
+        os.utime(path, (n, n))
+
+    (tmp_path / 'other.txt').write_text('kept')
+    prune(str(tmp_path), max_files=10, max_bytes=25)
+    assert sorted(os.listdir(tmp_path)) == ['3.folded', '4.folded', 'other.txt']
@@ -0,0 +1,54 @@
+'''
+
+Named statements should be counted and timed per app as the views run
+them, the statement cache should have room for all of them, and flask
+queries should show the plan of each one.
+
+'''
+
+import sqlite3
+
+import pytest
+from flaskr.db import get_db
+from flaskr.queries import QUERIES, get_stats, run, statement_cache_size
+
+
+def test_stats_recorded(app, client, auth):
+    auth.login()
+    get_stats(app).reset()
+    client.get('/')
+    client.get('/1')
+    client.post('/create', data={'title': 'created', 'body': ''})
+
+    stats = get_stats(app).snapshot()
+    assert stats['post.page']['calls'] == 1
+    assert stats['post.by_id']['calls'] == 1
+    assert stats['post.insert']['calls'] == 1
+    assert stats['post.insert']['errors'] == 0
+    assert stats['post.page']['seconds'] > 0
+
+
+def test_errors_recorded(app):
+    with app.app_context():
+        with pytest.raises(sqlite3.IntegrityError):
+            run(get_db(), 'user.insert', ('test', 'x'))
+
+        with pytest.raises(KeyError):
+            run(get_db(), 'no.such.query')
+
+        assert get_stats().snapshot()['user.insert']['errors'] == 1
+
+
+def test_statement_cache_size():
+    assert statement_cache_size() >= len(QUERIES) + 128
+
+
+def test_queries_command(runner):
+    result = runner.invoke(args=['queries'])
+    assert result.exit_code == 0
+
+    for name in QUERIES:
+        assert f'{name}: ' in result.output
+
+    # the keyset pagination is answered by the (created, id) index
+    assert 'post_created_id' in result.output
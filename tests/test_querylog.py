@@ -0,0 +1,76 @@
+'''
+
+With SQL_INSTRUMENT enabled, each response carries the number of queries 
+the request ran and how long they took. The log records the shape of 
+the parameters and the rows fetched, and repeated or slow statements are 
+reported as warnings.
+
+'''
+
+import logging
+
+from flaskr.db import get_db
+from flaskr.querylog import InstrumentedConnection, get_query_log
+
+
+def test_headers_disabled(client):
+    response = client.get('/')
+    assert 'X-SQL-Queries' not in response.headers
+
+
+def test_plain_connections_when_disabled(app):
+    with app.app_context():
+        assert not isinstance(get_db(), InstrumentedConnection)
+
+    app.config['SERVER_TIMING'] = True
+
+    with app.app_context():
+        assert isinstance(get_db(), InstrumentedConnection)
+
+
+def test_headers(app, client, auth):
+    app.config['SQL_INSTRUMENT'] = True
+    response = client.get('/1/update')
+    assert 'X-SQL-Queries' not in response.headers
+
+    auth.login()
+    response = client.get('/1/update')
+    # load the user, then the post
+    assert response.headers['X-SQL-Queries'] == '2'
+    assert float(response.headers['X-SQL-Time']) >= 0
+
+
+def test_records_statements(app):
+    app.config['SQL_INSTRUMENT'] = True
+
+    with app.test_request_context():
+        db = get_db()
+        db.execute('SELECT * FROM user WHERE id > ?', (0,)).fetchall()
+        rows = list(db.execute('SELECT * FROM post'))
+        db.execute("UPDATE user SET password = 'x'")
+        queries = get_query_log().queries
+
+    assert len(rows) == 1
+    assert [q['rows'] for q in queries] == [2, 1, 2]
+    assert queries[0]['params'] == ('int',)
+
+
+def test_warnings(app, caplog):
+    app.config.update(
+        SQL_INSTRUMENT=True, SQL_SLOW_QUERY_MS=-1, SQL_N_PLUS_ONE_THRESHOLD=3
+    )
+
+    @app.route('/n-plus-one')
+    def n_plus_one():
+        db = get_db()
+
+        for id in (1, 2, 3):
+            db.execute('SELECT * FROM user WHERE id = ?', (id,)).fetchone()
+
+        return ''
+
+    with caplog.at_level(logging.WARNING):
+        app.test_client().get('/n-plus-one')
+
+    assert 'possible N+1' in caplog.text
+    assert 'Slow query' in caplog.text
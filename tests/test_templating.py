@@ -0,0 +1,75 @@
+'''
+
+flask compile-templates should write the compiled code of every
+template to the bytecode cache, and with TEMPLATE_WARMUP every template
+should be loaded by the time create_app() returns.
+
+'''
+
+import os
+
+import pytest
+from flaskr.templating import get_build_id
+
+
+@pytest.fixture
+def make_cached_app(make_app, tmp_path):
+    def make_cached_app():
+        return make_app(
+            TEMPLATE_BYTECODE_CACHE=True,
+            TEMPLATE_CACHE_DIR=str(tmp_path / 'jinja_cache'),
+        )
+
+    return make_cached_app
+
+
+def test_disabled_when_testing(app, runner):
+    assert app.jinja_env.bytecode_cache is None
+    assert not app.jinja_env.cache
+    result = runner.invoke(args=['compile-templates'])
+    assert 'disabled' in result.output
+
+
+def test_compile_templates(make_cached_app, tmp_path):
+    cached_app = make_cached_app()
+    templates = cached_app.jinja_env.list_templates(extensions=('html',))
+    result = cached_app.test_cli_runner().invoke(
+        args=['compile-templates', '--clear']
+    )
+
+    assert f'Compiled {len(templates)} templates' in result.output
+    assert len(os.listdir(tmp_path / 'jinja_cache')) == len(templates)
+
+
+def test_bytecode_cache_used(make_cached_app, monkeypatch):
+    make_cached_app().test_cli_runner().invoke(args=['compile-templates'])
+    cached_app = make_cached_app()
+
+    def compile(*args, **kwargs):
+        raise AssertionError('template compiled despite the cache')
+
+    monkeypatch.setattr(cached_app.jinja_env, 'compile', compile)
+    assert cached_app.test_client().get('/').status_code == 200
+
+
+def test_warmup(make_app):
+    warm_app = make_app(TEMPLATE_WARMUP=True)
+    templates = warm_app.jinja_env.list_templates(extensions=('html',))
+    assert len(warm_app.jinja_env.cache) == len(templates)
+
+
+def test_build_id(app, make_app):
+    assert get_build_id(make_app(BUILD_ID='v2')) == 'v2'
+
+    build_id = get_build_id(app)
+    assert build_id == get_build_id(make_app())
+
+    # rebuilt assets make another build
+    rebuilt = make_app()
+    rebuilt.extensions['flaskr.assets'] = {'style.css': 'style.0123.css'}
+    assert get_build_id(rebuilt) != build_id
+
+
+def test_bytecode_cache_needs_folder(make_cached_app, tmp_path):
+    assert make_cached_app().test_client().get('/').status_code == 200
+    assert not (tmp_path / 'jinja_cache').exists()
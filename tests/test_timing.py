@@ -0,0 +1,50 @@
+'''
+
+With SERVER_TIMING enabled, responses should carry a Server-Timing
+header with the time spent on SQL, templates, password hashing and the
+session, and the total.
+
+'''
+
+import re
+
+import pytest
+
+
+@pytest.fixture
+def timed_client(make_app):
+    # the session interface is wrapped when the app is created
+    return make_app(SERVER_TIMING=True).test_client()
+
+
+def parse(header):
+    timings = {}
+
+    for part in header.split(', '):
+        match = re.fullmatch(r'(\w+)(?:;desc="([^"]*)")?;dur=([\d.]+)', part)
+        assert match is not None, part
+        timings[match.group(1)] = (match.group(2), float(match.group(3)))
+
+    return timings
+
+
+def test_disabled(client):
+    assert 'Server-Timing' not in client.get('/').headers
+
+
+def test_index(timed_client):
+    timings = parse(timed_client.get('/').headers['Server-Timing'])
+    assert set(timings) == {'db', 'template', 'hash', 'session', 'total'}
+    assert timings['db'][0] == '2 queries'
+    assert timings['template'][1] > 0
+    assert timings['hash'][1] == 0
+    assert timings['total'][1] >= timings['template'][1] + timings['db'][1]
+
+
+def test_login_hash(timed_client):
+    response = timed_client.post(
+        '/auth/login', data={'username': 'test', 'password': 'test'}
+    )
+    timings = parse(response.headers['Server-Timing'])
+    assert timings['hash'][1] > 0
+    assert timings['template'][1] == 0
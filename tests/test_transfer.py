@@ -0,0 +1,267 @@
+'''
+
+The import-posts command is invoked with the runner fixture on small 
+files written to pytest's tmp_path. The posts should end up in the 
+database, in the full text index, and errors in the input should be 
+reported with their line number.
+
+'''
+
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from flaskr.db import get_db
+from flaskr.queries import get_stats
+from flaskr.transfer import drop_post_indexes, iter_posts, restore_post_indexes
+
+
+def count_posts(app):
+    with app.app_context():
+        return get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0]
+
+
+@pytest.mark.parametrize('defer', ([], ['--defer-indexes']))
+def test_import_jsonl(runner, app, tmp_path, defer):
+    with app.app_context():
+        indexes = get_db().execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE tbl_name = 'post'"
+            " AND type IN ('index', 'trigger')"
+        ).fetchone()[0]
+
+    path = tmp_path / 'posts.jsonl'
+    path.write_text('\n'.join(json.dumps(record) for record in (
+        {'title': 'one', 'body': 'imported', 'author': 'test'},
+        {'title': 'two', 'author_id': 2, 'created': '2019-01-01T02:00+02:00'},
+        {'title': 'three', 'author': 'other'},
+    )))
+    result = runner.invoke(
+        args=['import-posts', '--batch-size', '2', str(path), *defer]
+    )
+
+    assert 'Imported 3 posts' in result.output
+    assert count_posts(app) == 4
+    # one executemany per batch, through the statement registry
+    assert get_stats(app).snapshot()['post.import']['calls'] == 2
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute("SELECT * FROM post WHERE title = 'two'").fetchone()
+        assert post['author_id'] == 2
+        assert post['created'] == datetime(2019, 1, 1)
+        # the same as a migrated database, whose trigger copies created
+        assert post['updated'] == post['created']
+        assert db.execute(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH 'imported'"
+        ).fetchone() is not None
+        assert db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE tbl_name = 'post'"
+            " AND type IN ('index', 'trigger')"
+        ).fetchone()[0] == indexes
+        assert db.execute('SELECT COUNT(*) FROM post_change').fetchone()[0] == 4
+        assert db.execute('SELECT version FROM post_version').fetchone()[0] > 1
+
+
+def test_defer_indexes_keeps_change_triggers(app):
+    with app.app_context():
+        db = get_db()
+        statements = drop_post_indexes(db)
+        names = {row[0] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE tbl_name = 'post'"
+            " AND type IN ('index', 'trigger')"
+        )}
+
+        assert 'post_created_id' not in names
+        assert not any(name.startswith('post_fts') for name in names)
+        assert {'post_version_update', 'post_version_insert',
+                'post_change_insert'} <= names
+
+        # a post written by the app during the import is recorded
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('a', '', 1)")
+        db.commit()
+        assert db.execute('SELECT COUNT(*) FROM post_change').fetchone()[0] == 2
+
+        restore_post_indexes(db, statements)
+        assert db.execute(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH 'a'"
+        ).fetchone() is not None
+
+
+def test_import_csv_gzip(runner, app, tmp_path):
+    path = tmp_path / 'posts.csv.gz'
+
+    with gzip.open(path, 'wt', newline='') as f:
+        f.write('title,body,author\r\nfirst,"multi\r\nline",test\r\n')
+
+    result = runner.invoke(args=['import-posts', str(path)])
+    assert 'Imported 1 posts' in result.output
+    assert count_posts(app) == 2
+
+
+@pytest.mark.parametrize(('line', 'message'), (
+    ('{"title": "", "author": "test"}', 'line 1: title is required.'),
+    ('{"title": "x", "author": "nobody"}', "line 1: unknown author 'nobody'."),
+    ('{"title": ', 'line 1:'),
+    ('{"title": "x", "author_id": "abc"}', "line 1: invalid author_id 'abc'."),
+    ('{"title": "x", "author_id": 99}', 'line 1: unknown author_id 99.'),
+    ('{"title": "x", "author_id": 99999999999999999999999}',
+     'line 1: invalid author_id 99999999999999999999999.'),
+    ('{"title": "x", "author_id": 1e30}', 'line 1: invalid author_id 1e+30.'),
+    ('[1, 2]', 'line 1: expected a JSON object.'),
+    ('{"title": "x", "author": "test", "created": "yesterday"}',
+     "line 1: invalid created time 'yesterday'."),
+))
+def test_import_validate(runner, app, tmp_path, line, message):
+    path = tmp_path / 'posts.jsonl'
+    path.write_text(line)
+    result = runner.invoke(args=['import-posts', str(path)])
+
+    assert result.exit_code != 0
+    assert message in result.output
+    assert count_posts(app) == 1
+
+
+def test_export_command(runner, tmp_path):
+    result = runner.invoke(args=['export-posts'])
+    post = json.loads(result.output)
+    assert post['title'] == 'test title'
+    assert post['username'] == 'test'
+    assert post['created'] == '2018-01-01 00:00:00'
+
+    result = runner.invoke(args=['export-posts', '--since', '2019-01-01'])
+    assert result.output == ''
+
+    path = tmp_path / 'posts.jsonl.gz'
+    runner.invoke(args=['export-posts', '--gzip', '-o', str(path)])
+
+    with gzip.open(path, 'rt') as f:
+        assert json.loads(f.read())['id'] == 1
+
+
+def test_export_view(client, auth, app):
+    assert client.get('/export.jsonl').status_code == 302
+    auth.login()
+
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO post (title, body, author_id, created)"
+            " VALUES ('new', '', 2, '2019-06-01 00:00:00')"
+        )
+        db.commit()
+
+    lines = client.get('/export.jsonl').data.splitlines()
+    assert [json.loads(line)['title'] for line in lines] == ['test title', 'new']
+
+    response = client.get('/export.jsonl?gzip=1&since=2019-01-01')
+    assert response.mimetype == 'application/gzip'
+    lines = gzip.decompress(response.data).splitlines()
+    assert [json.loads(line)['username'] for line in lines] == ['other']
+
+    assert client.get('/export.jsonl?until=soon').status_code == 400
+
+    # offsets are converted to UTC, 2019-06-01 02:00+02:00 is the
+    # created time of the new post
+    response = client.get(
+        '/export.jsonl', query_string={'since': '2019-06-01T02:00+02:00'}
+    )
+    lines = response.data.splitlines()
+    assert [json.loads(line)['title'] for line in lines] == ['new']
+
+
+def test_export_chunks(app):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id, created)"
+            " VALUES (?, '', 1, '2018-01-01 00:00:00')",
+            [(f'post {n}',) for n in range(4)],
+        )
+        db.commit()
+
+        posts = list(iter_posts(chunk_size=2))
+        assert [post['id'] for post in posts] == [1, 2, 3, 4, 5]
+
+        posts = iter_posts(until=datetime(2019, 1, 1), chunk_size=1)
+        assert len(list(posts)) == 5
+
+
+def test_export_streamed_during_write(make_app):
+    app = make_app(
+        EXPORT_CHUNK_SIZE=10,
+        DB_PRAGMA_PROFILE='default',
+        DB_PRAGMAS={'busy_timeout': 100},
+    )
+
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id) VALUES (?, '', 1)",
+            [(f'post {n}',) for n in range(200)],
+        )
+        db.commit()
+
+    reader = app.test_client()
+    writer = app.test_client()
+
+    for client in (reader, writer):
+        client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+
+    export = reader.get('/export.jsonl', buffered=False)
+    chunks = export.iter_encoded()
+    next(chunks)
+
+    # the export is only part way through, the write still goes through
+    # without waiting for it
+    response = writer.post('/create', data={'title': 'created', 'body': ''})
+    assert response.status_code == 302
+
+    lines = b''.join(chunks).splitlines()
+    assert len(lines) >= 200
+    export.close()
+
+
+def test_changes_view(client, auth, app):
+    assert client.get('/changes').status_code == 302
+    auth.login()
+
+    feed = client.get('/changes').get_json()
+    assert [c['id'] for c in feed['changes']] == [1]
+    assert feed['changes'][0]['post']['title'] == 'test title'
+    since = feed['next']
+
+    assert client.get(f'/changes?since={since}').get_json()['changes'] == []
+
+    client.post('/create', data={'title': 'created', 'body': ''})
+    client.post('/1/delete')
+    app.config['CHANGES_PAGE_SIZE'] = 1
+    feed = client.get(f'/changes?since={since}').get_json()
+    assert feed['more']
+    assert feed['changes'][0]['op'] == 'upsert'
+    assert feed['changes'][0]['post']['title'] == 'created'
+
+    feed = client.get(f'/changes?since={feed["next"]}').get_json()
+    assert not feed['more']
+    assert feed['changes'] == [{
+        'seq': feed['next'], 'id': 1, 'op': 'delete',
+        'changed': feed['changes'][0]['changed'], 'post': None,
+    }]
+
+    assert client.get('/changes?since=x').status_code == 400
+    assert client.get(f'/changes?since={2**80}').status_code == 400
+
+
+def test_changes_command(runner, app):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'edited' WHERE id = 1")
+        db.commit()
+
+    result = runner.invoke(args=['changes', '--since', '0'])
+    lines = result.output.splitlines()
+    change = json.loads(lines[0])
+    assert change['post']['title'] == 'edited'
+    assert lines[-1] == f'next: {change["seq"]}'
+    assert change['seq'] > 1
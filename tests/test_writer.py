@@ -0,0 +1,143 @@
+'''
+
+Jobs submitted close together to the WriteQueue should be committed
+together in one transaction, and a job that fails should only roll back
+its own changes. With WRITE_QUEUE enabled, the blog views should write
+through the queue. A batch that fails outside of its jobs shouldn't stop
+the writer thread, and a job that times out in the queue shouldn't run.
+
+'''
+
+import sqlite3
+import threading
+from concurrent import futures
+
+import pytest
+from flaskr.db import connect, get_db
+from flaskr.writer import WriteQueue, _stop, get_write_queue, run_write
+
+
+def make_queue(app, window=0.2):
+    return WriteQueue(
+        lambda: connect(app.config, check_same_thread=False,
+                        isolation_level=None),
+        window=window,
+    )
+
+
+def insert_user(db, username):
+    return db.execute(
+        'INSERT INTO user (username, password) VALUES (?, ?)', (username, 'x')
+    ).lastrowid
+
+
+def test_group_commit(app):
+    writes = make_queue(app)
+    pending = [writes.submit(insert_user, f'user{n}') for n in range(5)]
+
+    try:
+        ids = [future.result(timeout=5) for future in pending]
+    finally:
+        writes.close()
+
+    assert len(set(ids)) == 5
+    assert writes.jobs == 5
+    assert writes.batches == 1
+
+    with app.app_context():
+        count = get_db().execute(
+            "SELECT COUNT(*) FROM user WHERE username LIKE 'user%'"
+        ).fetchone()[0]
+        assert count == 5
+
+
+def test_failed_job_rolled_back_alone(app):
+    writes = make_queue(app)
+    pending = [writes.submit(insert_user, name)
+               for name in ('first', 'test', 'last')]
+
+    try:
+        assert pending[0].result(timeout=5)
+        assert pending[2].result(timeout=5)
+
+        with pytest.raises(sqlite3.IntegrityError):
+            pending[1].result(timeout=5)
+    finally:
+        writes.close()
+
+    with app.app_context():
+        names = {row[0] for row in get_db().execute('SELECT username FROM user')}
+        assert {'first', 'last'} <= names
+
+
+def test_views_use_queue(app, client, auth):
+    auth.login()
+    app.config['WRITE_QUEUE'] = True
+
+    try:
+        client.post('/create', data={'title': 'queued', 'body': ''})
+        client.post('/1/update', data={'title': 'edited', 'body': ''})
+        writes = get_write_queue(app)
+        assert writes.jobs == 2
+    finally:
+        get_write_queue(app).close()
+
+    with app.app_context():
+        titles = {row[0] for row in get_db().execute('SELECT title FROM post')}
+        assert titles == {'edited', 'queued'}
+
+
+def test_survives_failed_batch(app):
+    # fail at once instead of waiting for the lock
+    app.config['DB_PRAGMAS'] = {'busy_timeout': 0}
+    writes = make_queue(app, window=0)
+    other = sqlite3.connect(app.config['DATABASE'], isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            writes.submit(insert_user, 'locked').result(timeout=5)
+
+        other.execute('ROLLBACK')
+        assert writes.submit(insert_user, 'unlocked').result(timeout=5)
+    finally:
+        other.close()
+        writes.close()
+
+
+def test_restarts_dead_thread(app):
+    writes = make_queue(app, window=0)
+    writes.submit(insert_user, 'first').result(timeout=5)
+    # as if the thread had died
+    writes._jobs.put(_stop)
+    writes._thread.join()
+    assert writes.submit(insert_user, 'second').result(timeout=5)
+    writes.close()
+
+
+def test_timeout_cancels_job(app):
+    app.config['WRITE_QUEUE'] = True
+    app.config['WRITE_QUEUE_TIMEOUT'] = 0.05
+    writes = get_write_queue(app)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block(db):
+        started.set()
+        release.wait(5)
+
+    try:
+        writes.submit(block)
+        started.wait(5)
+
+        with app.test_request_context():
+            with pytest.raises(futures.TimeoutError):
+                run_write(insert_user, 'late')
+    finally:
+        release.set()
+        writes.close()
+
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT 1 FROM user WHERE username = 'late'"
+        ).fetchone() is None